@@ -0,0 +1,181 @@
+"""
+Benchmarks of the hot paths of the library.
+
+Usage: python -m benchmarks [--output results.json] [--baseline baseline.json] [--sizes 10000 100000 1000000]
+"""
+from connect4.connect_environment import ConnectEnvironment
+from rfl.env.abstract_environment import Episode
+from rfl.abstract_replay_buffer import AbstractReplayBuffer
+from rfl.uniform_replay_buffer import UniformReplayBuffer
+from rfl.prioritized_replay_buffer import PrioritizedReplayBuffer
+from rfl.ring_replay_buffer import RingReplayBuffer
+from rfl.memmap_replay_buffer import MemmapReplayBuffer
+from rfl.policies import random_policy
+
+from typing import Callable, Dict, List, Tuple
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# name -> {"value", "unit", "higher_is_better"}
+Results = Dict[str, Dict]
+
+
+def measure(fn: Callable[[], None], repeat: int = 5, number: int = 1) -> float:
+    """
+    Return the median time in seconds of one call to the specified function.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+    return float(np.median(timings))
+
+
+def make_episodes(n: int, seed: int = 0) -> List[Episode]:
+    env = ConnectEnvironment(0)
+    env.attach_second_player(lambda env, player: random_policy(env))
+    np.random.seed(seed)
+    return env.do_episodes(random_policy, n)
+
+
+def bench_environment(results: Results, games: int):
+    env = ConnectEnvironment(0)
+    rng = np.random.default_rng(0)
+    moves = [0]
+
+    def play_game():
+        env.reset()
+        while not env.is_closed():
+            actions = env.get_possible_actions()
+            env.make_move(actions[rng.integers(len(actions))])
+            moves[0] += 1
+
+    start = time.perf_counter()
+    for _ in range(games):
+        play_game()
+    results["env.moves_per_sec"] = {"value": moves[0] / (time.perf_counter() - start), "unit": "moves/s", "higher_is_better": True}
+
+    env.attach_second_player(lambda env, player: random_policy(env))
+    start = time.perf_counter()
+    env.do_episodes(random_policy, games)
+    results["env.do_episodes_games_per_sec"] = {"value": games / (time.perf_counter() - start), "unit": "games/s", "higher_is_better": True}
+
+
+def fill(buffer: AbstractReplayBuffer, episodes: List[Episode], size: int):
+    transitions = sum(len(episode) for episode in episodes)
+    for _ in range(size // transitions + 1):
+        buffer.store(episodes)
+
+
+def bench_buffer(results: Results, name: str, make_buffer: Callable[[int], AbstractReplayBuffer],
+                 episodes: List[Episode], sizes: List[int], batch_size: int, nsteps: int):
+    for size in sizes:
+        buffer = make_buffer(size)
+        fill(buffer, episodes, size)
+        prefix = "{}.{}".format(name, size)
+        store = measure(lambda: buffer.store(episodes[:1]), repeat=9, number=5)
+        results[prefix + ".store_episode"] = {"value": store * 1e6, "unit": "us", "higher_is_better": False}
+        sample = measure(lambda: buffer.sample(batch_size, nsteps), repeat=9, number=5)
+        results[prefix + ".sample"] = {"value": sample * 1e6, "unit": "us", "higher_is_better": False}
+        if hasattr(buffer, "sample_batch"):
+            # The path used by training
+            sample = measure(lambda: buffer.sample_batch(batch_size, nsteps), repeat=9, number=5)
+            results[prefix + ".sample_batch"] = {"value": sample * 1e6, "unit": "us", "higher_is_better": False}
+        if isinstance(buffer, PrioritizedReplayBuffer):
+            losses = np.random.default_rng(0).random(batch_size)
+            # step updates the priorities of the last sampled batch
+            buffer.sample(batch_size, nsteps)
+            step = measure(lambda: buffer.step(losses, buffer.beta), repeat=9, number=5)
+            results[prefix + ".step"] = {"value": step * 1e6, "unit": "us", "higher_is_better": False}
+
+
+def bench_learners(results: Results, episodes: List[Episode], batch_size: int, steps: int):
+    import torch
+    from rfl.learner.semi_gradient_sarsa import SemiGradientSARSALearner
+    from rfl.learner.state_q_learner import StateQLearner
+
+    torch.set_num_threads(1)
+    for name, cls, make_buffer in (("sarsa", SemiGradientSARSALearner, UniformReplayBuffer), ("q", StateQLearner, UniformReplayBuffer),
+                                   ("sarsa_ring", SemiGradientSARSALearner, RingReplayBuffer), ("q_ring", StateQLearner, RingReplayBuffer)):
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(84, 128), torch.nn.ReLU(), torch.nn.Linear(128, 1))
+        buffer = make_buffer(100000)
+        buffer.store(episodes)
+        learner = cls(ConnectEnvironment(0), model, buffer)
+        learner.configure(gamma=.99, steps=3)
+        learner.setup_training(torch.nn.functional.mse_loss, torch.optim.SGD(model.parameters(), lr=1e-3), batch_size=batch_size)
+        duration = measure(learner.train, repeat=5, number=steps)
+        results["learner.{}.train_steps_per_sec".format(name)] = {"value": 1 / duration, "unit": "steps/s", "higher_is_better": True}
+
+
+def compare(results: Results, baseline: Results, tolerance: float) -> List[Tuple[str, float]]:
+    """
+    Print the ratio of each result to its baseline and return the (name, ratio) of the regressions beyond the tolerance.
+    A ratio above 1 is an improvement.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            print("{:<50} {:>14.2f} {:<8} (new)".format(name, result["value"], result["unit"]))
+            continue
+        base = baseline[name]["value"]
+        ratio = result["value"] / base if result["higher_is_better"] else base / result["value"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            flag = "REGRESSION"
+            regressions.append((name, ratio))
+        print("{:<50} {:>14.2f} {:<8} x{:.2f} {}".format(name, result["value"], result["unit"], ratio, flag))
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of the environment, replay buffers and learners.")
+    parser.add_argument("--output", type=str, default=None, help="file to write the results to as JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=.1, help="relative slowdown reported as a regression")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="replay buffer sizes")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--nsteps", type=int, default=3)
+    parser.add_argument("--games", type=int, default=500)
+    parser.add_argument("--train-steps", type=int, default=10)
+    parser.add_argument("--skip", type=str, nargs="*", default=[], choices=["env", "buffers", "learners"])
+    args = parser.parse_args(argv)
+
+    results: Results = {}
+    episodes = make_episodes(200)
+    if "env" not in args.skip:
+        bench_environment(results, args.games)
+    if "buffers" not in args.skip:
+        bench_buffer(results, "uniform", lambda size: UniformReplayBuffer(size), episodes, args.sizes, args.batch_size, args.nsteps)
+        bench_buffer(results, "ring", lambda size: RingReplayBuffer(size), episodes, args.sizes, args.batch_size, args.nsteps)
+        with tempfile.TemporaryDirectory() as directory:
+            bench_buffer(results, "memmap", lambda size: MemmapReplayBuffer(os.path.join(directory, str(size)), size),
+                         episodes, args.sizes, args.batch_size, args.nsteps)
+        bench_buffer(results, "prioritized", lambda size: PrioritizedReplayBuffer(size), episodes, args.sizes, args.batch_size, args.nsteps)
+        bench_buffer(results, "prioritized_rank", lambda size: PrioritizedReplayBuffer(size, method="rank"),
+                     episodes, args.sizes, args.batch_size, args.nsteps)
+    if "learners" not in args.skip:
+        bench_learners(results, episodes, args.batch_size, args.train_steps)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+    regressions = compare(results, baseline, args.tolerance)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+from typing import Union
+
+import numpy as np
+
+# A board of one player is encoded as an integer (fits in an uint64).
+# Each column uses HEIGHT + 1 bits, the extra top bit is always empty and acts as a separator
+# so that shifts do not wrap from one column to the next one.
+# Bit index of cell (x, y) is x * H1 + y.
+#
+#  6 13 20 27 34 41 48
+#  5 12 19 26 33 40 47
+#  4 11 18 25 32 39 46
+#  3 10 17 24 31 38 45
+#  2  9 16 23 30 37 44
+#  1  8 15 22 29 36 43
+#  0  7 14 21 28 35 42
+
+WIDTH: int = 7
+HEIGHT: int = 6
+H1: int = HEIGHT + 1
+CELLS: int = WIDTH * HEIGHT
+
+BOTTOM_MASK: int = sum(1 << (x * H1) for x in range(WIDTH))
+BOARD_MASK: int = BOTTOM_MASK * ((1 << HEIGHT) - 1)
+COLUMN_MASK: int = (1 << HEIGHT) - 1
+
+# Vertical, horizontal and the two diagonals
+SHIFTS = (1, H1, H1 + 1, H1 - 1)
+
+Board = Union[int, np.ndarray]
+
+
+def cell(x: int, y: int) -> int:
+    """
+    Return the bit of the cell at column x and row y.
+    """
+    return 1 << (x * H1 + y)
+
+
+def has_won(board: Board) -> Union[bool, np.ndarray]:
+    """
+    Return whether the specified board contains 4 aligned pieces.
+    Works both on a python integer and on a numpy array of uint64 boards.
+    """
+    won = False
+    for shift in SHIFTS:
+        m = board & (board >> shift)
+        won = won | ((m & (m >> (2 * shift))) != 0)
+    return won
+
+
+def mirror(board: Board) -> Board:
+    """
+    Return the board mirrored along the central column.
+    Works both on a python integer and on a numpy array of uint64 boards.
+    """
+    out = board & 0
+    for x in range(WIDTH):
+        out = out | (((board >> (x * H1)) & COLUMN_MASK) << ((WIDTH - 1 - x) * H1))
+    return out
+
+
+def pack(states: np.ndarray) -> np.ndarray:
+    """
+    Pack states of shape (..., 2, WIDTH, HEIGHT) into boards of shape (..., 2) of dtype uint64.
+    """
+    lead = states.shape[:-2]
+    padded = np.zeros(lead + (WIDTH, H1), dtype=np.uint8)
+    padded[..., :HEIGHT] = states != 0
+    bits = np.packbits(padded.reshape(lead + (WIDTH * H1,)), axis=-1, bitorder='little')
+    raw = np.zeros(lead + (8,), dtype=np.uint8)
+    raw[..., :bits.shape[-1]] = bits
+    return raw.view('<u8').reshape(lead).astype(np.uint64)
+
+
+def unpack(boards: np.ndarray, dtype=np.int64) -> np.ndarray:
+    """
+    Unpack boards of shape (..., 2) of dtype uint64 into states of shape (..., 2, WIDTH, HEIGHT).
+    """
+    boards = np.ascontiguousarray(boards, dtype='<u8')
+    lead = boards.shape
+    raw = boards.reshape(lead + (1,)).view(np.uint8)
+    bits = np.unpackbits(raw, axis=-1, count=WIDTH * H1, bitorder='little')
+    return bits.reshape(lead + (WIDTH, H1))[..., :HEIGHT].astype(dtype)
+
+
+def to_int(board: np.ndarray) -> int:
+    """
+    Convert a (WIDTH, HEIGHT) array of one player into its integer board.
+    """
+    return int(pack(board))
+
+
+def canonical_keys(boards: np.ndarray) -> np.ndarray:
+    """
+    Return the canonical keys of boards of shape (..., 2), a position and its mirror image share the same key.
+    Keys are the (..., 2) boards of the smallest of the two positions in lexicographic order.
+    """
+    mirrored = mirror(boards)
+    use_mirror = (mirrored[..., 0] < boards[..., 0]) | ((mirrored[..., 0] == boards[..., 0]) & (mirrored[..., 1] < boards[..., 1]))
+    return np.where(use_mirror[..., np.newaxis], mirrored, boards)
@@ -1,91 +1,126 @@
 from rfl.env.abstract_environment import Action, State
 from rfl.env.abstract_2player_environment import Abstract2PlayerEnvironment
+from connect4 import bitboard
 
-from typing import Tuple, ClassVar, List
+from typing import Tuple, ClassVar, List, Hashable
 
 import numpy as np
 
 
 class ConnectEnvironment(Abstract2PlayerEnvironment):
+    """
+    Connect 4 environment.
+
+    The board is kept both as a (2, 7, 6) array which is exposed to learners and as one bitboard per player
+    (see ```connect4.bitboard```) along with the height of each column and the number of moves played,
+    so that moves and win detection never scan the board.
+    """
 
     action_space: ClassVar[Tuple[Action]] = tuple(range(7))
-    directions: ClassVar[Tuple[Tuple[int, int]]] = ((1, 0), (0, 1), (1, 1), (1, -1))
 
     def __init__(self, player: int):
-        super(ConnectEnvironment, self).__init__(np.zeros((2, 7, 6), dtype=np.int), player)
+        super(ConnectEnvironment, self).__init__(np.zeros((2, 7, 6), dtype=np.int64), player)
+        self.boards: List[int] = [0, 0]
+        self.heights: List[int] = [0] * bitboard.WIDTH
+        self.moves: int = 0
+        # Undo records of make_move: (action, row of the piece, previous winner, previous turn)
+        self._undo: List[Tuple[Action, int, int, int]] = []
         self.reset()
 
     def get_state_with_action(self, state: State, action: Action) -> State:
-        tmp, self._state = self._state, state
-        self._push_action_(action)
-        self._state = tmp
+        y = np.count_nonzero(state[:, action, :])
+        if y < bitboard.HEIGHT:
+            state[self.turn, action, y] = 1
         return state
 
+    def get_state_keys(self, states: np.ndarray) -> List[Hashable]:
+        # A position and its mirror image are equivalent
+        keys = bitboard.canonical_keys(bitboard.pack(states))
+        return list(zip(keys[:, 0].tolist(), keys[:, 1].tolist()))
+
+    def get_states_with_actions(self, states: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        heights = np.count_nonzero(states, axis=(1, 3))
+        turn = (np.sum(states[:, 0], axis=(1, 2)) - np.sum(states[:, 1], axis=(1, 2))).astype(np.int64)
+        mask = heights < bitboard.HEIGHT
+        successors = np.repeat(states[:, np.newaxis], bitboard.WIDTH, axis=1)
+        b, a = np.nonzero(mask)
+        successors[b, a, turn[b], a, heights[b, a]] = 1
+        return successors, mask
+
+    def write_states_with_actions(self, out: np.ndarray, mask: np.ndarray):
+        np.copyto(out, self._state)
+        turn, heights = self.turn, self.heights
+        for x in range(bitboard.WIDTH):
+            y = heights[x]
+            legal = y < bitboard.HEIGHT
+            mask[x] = legal
+            if legal:
+                out[x, turn, x, y] = 1
+
+    def get_winning_actions_mask(self, states: np.ndarray) -> np.ndarray:
+        heights = np.count_nonzero(states, axis=(1, 3))
+        turn = (np.sum(states[:, 0], axis=(1, 2)) - np.sum(states[:, 1], axis=(1, 2))).astype(np.int64)
+        movers = bitboard.pack(states)[np.arange(states.shape[0]), turn]
+        cells = np.left_shift(np.uint64(1), (np.arange(bitboard.WIDTH) * bitboard.H1 + heights).astype(np.uint64))
+        return bitboard.has_won(movers[:, np.newaxis] | cells) & (heights < bitboard.HEIGHT)
+
     def get_flipped_state_copy(self) -> State:
         return self._state.copy()[::-1, :, :]
 
+    def reset(self):
+        # The undo records belong to the previous game
+        self._undo.clear()
+        super(ConnectEnvironment, self).reset()
+
     def set_state(self, state):
         super(ConnectEnvironment, self).set_state(state)
-        self.turn = np.sum(self._state[0]) - np.sum(self._state[1])
+        self.boards = [bitboard.to_int(state[0]), bitboard.to_int(state[1])]
+        self.heights = np.count_nonzero(state, axis=(0, 2)).tolist()
+        self.moves = sum(self.heights)
+        self.turn = int(np.sum(self._state[0]) - np.sum(self._state[1]))
 
     def get_flipped_state_with_action(self, state: State, action: Action) -> State:
-        tmp, self._state = self._state, state
-        self._push_action_(action)
-        self._state = tmp
-        return state[::-1, :, :]
+        return self.get_state_with_action(state, action)[::-1, :, :]
 
     def get_possible_actions(self) -> List[Action]:
-        return [x for x in ConnectEnvironment.action_space if self._state[0, x, -1] == 0 and self._state[1, x, -1] == 0]
-
-    def __top__(self, x: int) -> int:
-        for y in range(6):
-            if self._state[0, x, y] == 0 and self._state[1, x, y] == 0:
-                return y
-        return -1
-
-    def __count_dir__(self, x: int, y: int, player: int, vx: int, vy: int) -> int:
-        count = 1
-        for i in range(1, 4):
-            nx, ny = x + i * vx, y + i * vy
-            if nx >= 0 and nx < 7 and ny >= 0 and ny < 6 and self._state[player, nx, ny, ] == 1:
-                count += 1
-            else:
-                break
-
-        for i in range(1, 4):
-            nx, ny = x - i * vx, y - i * vy
-            if nx >= 0 and nx < 7 and ny >= 0 and ny < 6 and self._state[player, nx, ny] == 1:
-                count += 1
-            else:
-                break
-
-        return count
+        return [x for x in ConnectEnvironment.action_space if self.heights[x] < bitboard.HEIGHT]
 
     def _push_action_(self, action: Action):
         if self.is_closed():
             raise Exception("Fatal error: game is already closed !")
         turn = self.turn
-        y = self.__top__(action)
-        if y == -1:
+        y = self.heights[action]
+        if y == bitboard.HEIGHT:
             self.winner = 1 - turn
             print("Illegal move: making Player ", turn, "lose")
             return
         self._state[turn, action, y] = 1
+        self.boards[turn] |= bitboard.cell(action, y)
+        self.heights[action] = y + 1
+        self.moves += 1
+
+    def make_move(self, action: Action):
+        turn, winner, y = self.turn, self.winner, self.heights[action]
+        self._push_action_(action)
+        self._check_is_closed_from_action_(action)
+        if not self.is_closed():
+            self.next_turn()
+        self._undo.append((action, y, winner, turn))
+
+    def unmake_move(self):
+        action, y, self.winner, self.turn = self._undo.pop()
+        if y < bitboard.HEIGHT:
+            self._state[self.turn, action, y] = 0
+            self.boards[self.turn] ^= bitboard.cell(action, y)
+            self.heights[action] = y
+            self.moves -= 1
 
     def _check_is_closed_from_action_(self, action: Action):
         if self.is_closed():
             return
-        y = self.__top__(action)
-        if y == -1:
-            y = self._state.shape[2] - 1
-        else:
-            y -= 1
-        for (vx, vy) in ConnectEnvironment.directions:
-            if self.__count_dir__(action, y, self.turn, vx, vy) >= 4:
-                self.winner = self.turn
-                return
-
-        if np.sum(self._state) == 42:
+        if bitboard.has_won(self.boards[self.turn]):
+            self.winner = self.turn
+        elif self.moves == bitboard.CELLS:
             self.winner = 9999
 
 
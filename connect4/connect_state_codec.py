@@ -0,0 +1,16 @@
+from rfl.state_codec import StateCodec
+from connect4 import bitboard
+
+import numpy as np
+
+
+class ConnectStateCodec(StateCodec):
+    """
+    Encode (2, 7, 6) Connect 4 states as their 2 bitboards, 16 bytes per state.
+    """
+
+    def encode(self, states: np.ndarray) -> np.ndarray:
+        return bitboard.pack(states)
+
+    def decode(self, encoded: np.ndarray) -> np.ndarray:
+        return bitboard.unpack(encoded, dtype=np.float32)
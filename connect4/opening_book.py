@@ -0,0 +1,235 @@
+"""
+Opening book of Connect 4: the scores and best moves of all the positions up to a number of plies, searched by
+```NegamaxSolver``` and stored in a sorted table on disk.
+
+Usage: python -m connect4.opening_book --plies 8 --output book [--node-budget 200000] [--processes 8]
+"""
+from rfl.env.abstract_environment import Action
+from connect4.connect_environment import ConnectEnvironment
+from connect4.solver import NegamaxSolver, COLUMNS
+from connect4 import bitboard
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+import argparse
+import multiprocessing
+
+import numpy as np
+
+# A book is two parallel files: the sorted canonical position keys, in their own contiguous array so that a binary
+# search only reads the pages on its path, and the entries of the positions
+KEYS_SUFFIX: str = ".keys.npy"
+ENTRIES_SUFFIX: str = ".entries.npy"
+# score: from the point of view of the player to move, move: best column of the canonical position
+ENTRY = np.dtype([("score", "i1"), ("move", "i1")])
+# Score of the positions whose search did not prove a win, a loss or a draw, their move is the best one found
+UNKNOWN_SCORE: int = int(np.iinfo(np.int8).min)
+
+_worker_solver: Optional[NegamaxSolver] = None
+
+
+def position_key(board0: int, board1: int) -> Tuple[int, bool]:
+    """
+    Return the canonical key of the position with the specified bitboards of the players and whether it is the key of
+    the mirrored position.
+    The key of a position is the bitboard of the first player plus the bitboard of all pieces, which is unique,
+    the canonical key is the smallest of the keys of the position and of its mirror.
+    """
+    mask = board0 | board1
+    key = board0 + mask
+    mirrored = bitboard.mirror(board0) + bitboard.mirror(mask)
+    return (mirrored, True) if mirrored < key else (key, False)
+
+
+def position_keys(boards: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized ```position_key``` of (N, 2) uint64 bitboards.
+    """
+    board0 = boards[..., 0]
+    mask = board0 | boards[..., 1]
+    key = board0 + mask
+    mirrored = bitboard.mirror(board0) + bitboard.mirror(mask)
+    flipped = mirrored < key
+    return np.where(flipped, mirrored, key), flipped
+
+
+def enumerate_positions(plies: int) -> Dict[int, Tuple[int, int, int]]:
+    """
+    Enumerate the positions that are not over reachable in at most the specified number of plies, one per canonical key.
+
+    Return
+    -----------
+    The dictionary mapping canonical keys to the (board0, board1, moves) of the position in its canonical orientation.
+    """
+    level: Dict[int, Tuple[int, int, int]] = {position_key(0, 0)[0]: (0, 0, 0)}
+    positions = dict(level)
+    for moves in range(plies):
+        following: Dict[int, Tuple[int, int, int]] = {}
+        for (board0, board1, _) in level.values():
+            mask = board0 | board1
+            possible = (mask + bitboard.BOTTOM_MASK) & bitboard.BOARD_MASK
+            for column in COLUMNS:
+                move = possible & column
+                if not move:
+                    continue
+                boards = [board0, board1]
+                boards[moves % 2] |= move
+                if bitboard.has_won(boards[moves % 2]) or moves + 1 == bitboard.CELLS:
+                    continue
+                key, flipped = position_key(*boards)
+                if key not in following:
+                    if flipped:
+                        boards = [bitboard.mirror(boards[0]), bitboard.mirror(boards[1])]
+                    following[key] = (boards[0], boards[1], moves + 1)
+        positions.update(following)
+        level = following
+    return positions
+
+
+def _init_worker_(max_depth: int, node_budget: Optional[int], time_budget: Optional[float]):
+    global _worker_solver
+    _worker_solver = NegamaxSolver(max_depth, node_budget, time_budget)
+
+
+def _solve_(positions: List[Tuple[int, int, int]]) -> List[Tuple[int, int]]:
+    output = []
+    for (board0, board1, moves) in positions:
+        score, move = _worker_solver.search((board0, board1)[moves % 2], board0 | board1, moves)
+        output.append((score if _worker_solver.exact else UNKNOWN_SCORE, move))
+    return output
+
+
+def save_book(path: str, keys: np.ndarray, entries: np.ndarray):
+    """
+    Save a book of the specified sorted keys and their entries to the files of the specified path.
+    """
+    np.save(path + KEYS_SUFFIX, np.asarray(keys, dtype="<u8"))
+    np.save(path + ENTRIES_SUFFIX, np.asarray(entries, dtype=ENTRY))
+
+
+def build_book(plies: int, path: Optional[str] = None, max_depth: int = bitboard.CELLS, node_budget: Optional[int] = 200000,
+               time_budget: Optional[float] = None, processes: Optional[int] = None,
+               chunk: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search all the positions up to the specified number of plies with ```NegamaxSolver``` over a process pool.
+    Positions whose search did not prove their outcome within the budget get the score ```UNKNOWN_SCORE```
+    and the best move of the deepest search.
+
+    Parameters
+    -----------
+    - **plies**: the maximum number of pieces of the positions of the book
+    - **path**: the path the book is saved to with ```save_book```, None to only return it
+    - **max_depth**: the maximum depth of the search in plies
+    - **node_budget**: the maximum number of nodes explored per position, unlimited if None
+    - **time_budget**: the maximum time spent per position in seconds, unlimited if None
+    - **processes**: the number of worker processes, the number of CPUs by default
+    - **chunk**: the number of positions per task sent to a worker
+
+    Return
+    -----------
+    The sorted keys of the book and their entries.
+    """
+    positions = enumerate_positions(plies)
+    keys = sorted(positions.keys())
+    tasks = [[positions[key] for key in keys[start:start + chunk]] for start in range(0, len(keys), chunk)]
+    context = multiprocessing.get_context("fork")
+    with context.Pool(processes, initializer=_init_worker_, initargs=(max_depth, node_budget, time_budget)) as pool:
+        results = [result for task in pool.map(_solve_, tasks, chunksize=1) for result in task]
+    entries = np.zeros(len(keys), dtype=ENTRY)
+    entries["score"] = [score for (score, _) in results]
+    entries["move"] = [move for (_, move) in results]
+    keys = np.asarray(keys, dtype="<u8")
+    if path is not None:
+        save_book(path, keys, entries)
+    return keys, entries
+
+
+class OpeningBook():
+    """
+    Opening book files opened with mmap, a position is found by binary search over the sorted keys
+    so only the pages on the search path are read.
+
+    Parameters
+    -----------
+    - **path**: the path given to ```build_book```
+    """
+
+    def __init__(self, path: str):
+        self._keys: np.ndarray = np.load(path + KEYS_SUFFIX, mmap_mode="r")
+        self.entries: np.ndarray = np.load(path + ENTRIES_SUFFIX, mmap_mode="r")
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return self.entries.shape[0]
+
+    def lookup(self, board0: int, board1: int) -> Optional[Tuple[Optional[int], Action]]:
+        """
+        Return the score from the point of view of the player to move, None if it is unknown, and the best move of the
+        position with the specified bitboards, None if it is not in the book.
+        """
+        key, flipped = position_key(board0, board1)
+        i = int(np.searchsorted(self._keys, np.uint64(key)))
+        if i == len(self) or int(self._keys[i]) != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry = self.entries[i]
+        move, score = int(entry["move"]), int(entry["score"])
+        return (None if score == UNKNOWN_SCORE else score), (bitboard.WIDTH - 1 - move if flipped else move)
+
+    def lookup_batch(self, boards: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Look up the positions of the specified (N, 2) uint64 bitboards at once.
+
+        Return
+        -----------
+        The (N,) boolean array of the positions found, their scores, ```UNKNOWN_SCORE``` where unknown, and their best moves,
+        undefined where not found.
+        """
+        keys, flipped = position_keys(np.asarray(boards, dtype=np.uint64))
+        if len(self) == 0:
+            zeros = np.zeros(keys.shape, dtype=np.int64)
+            return np.zeros(keys.shape, dtype=bool), zeros, zeros
+        indices = np.minimum(np.searchsorted(self._keys, keys), len(self) - 1)
+        found = self._keys[indices] == keys
+        entries = self.entries[indices]
+        moves = entries["move"].astype(np.int64)
+        return found, entries["score"].astype(np.int64), np.where(flipped, bitboard.WIDTH - 1 - moves, moves)
+
+
+def book_policy(book: OpeningBook, fallback: Callable) -> Callable[[ConnectEnvironment, Optional[int]], Action]:
+    """
+    Create a policy playing the move of the book when the position is in it and the move of the fallback otherwise.
+    It can be used both as a policy and as a second player with ```attach_second_player``` if the fallback can.
+
+    Parameters
+    -----------
+    - **book**: the opening book
+    - **fallback**: the policy used for the positions that are not in the book
+
+    Return
+    -----------
+    The new book policy
+    """
+    def f(env: ConnectEnvironment, player: Optional[int] = None) -> Action:
+        found = book.lookup(env.boards[0], env.boards[1])
+        if found is not None:
+            return found[1]
+        return fallback(env) if player is None else fallback(env, player)
+    return f
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a Connect 4 opening book.")
+    parser.add_argument("--plies", type=int, default=6)
+    parser.add_argument("--output", type=str, default="book")
+    parser.add_argument("--max-depth", type=int, default=bitboard.CELLS)
+    parser.add_argument("--node-budget", type=int, default=200000)
+    parser.add_argument("--time-budget", type=float, default=None)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+    keys, entries = build_book(args.plies, args.output, args.max_depth, args.node_budget, args.time_budget, args.processes)
+    unknown = np.count_nonzero(entries["score"] == UNKNOWN_SCORE)
+    solved = np.count_nonzero(entries["score"] != 0) - unknown
+    print("{} positions, {} with a proven win or loss, {} unknown, saved to {}".format(keys.shape[0], solved, unknown, args.output))
@@ -0,0 +1,193 @@
+from rfl.env.abstract_environment import Action
+from connect4.connect_environment import ConnectEnvironment
+from connect4 import bitboard
+
+from typing import Callable, Optional, Tuple, List
+
+import time
+
+# Columns explored from the center outwards
+CENTER_FIRST: Tuple[int] = (3, 2, 4, 1, 5, 0, 6)
+BOTTOM: List[int] = [bitboard.cell(x, 0) for x in range(bitboard.WIDTH)]
+COLUMNS: List[int] = [bitboard.COLUMN_MASK << (x * bitboard.H1) for x in range(bitboard.WIDTH)]
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class NegamaxSolver():
+    """
+    Depth-limited negamax search with alpha-beta pruning, center-first move ordering,
+    iterative deepening and a fixed-size transposition table.
+
+    Positions are given as the bitboard of the player to move, the bitboard of all pieces and the number of moves played.
+    Scores are given from the point of view of the player to move: a win with k pieces of the winner still to be placed
+    has a score of k + 1, a loss the opposite, 0 means a draw or nothing found within the search depth.
+    After a search, **exact** tells whether its score is proven, that is a win or a loss, or a draw searched to the end of the game.
+
+    Parameters
+    -----------
+    - **max_depth**: the maximum depth of the search in plies
+    - **node_budget**: the maximum number of nodes explored per search, unlimited if None
+    - **time_budget**: the maximum time spent per search in seconds, unlimited if None
+    - **table_size**: the number of entries of the transposition table
+    """
+
+    def __init__(self, max_depth: int = bitboard.CELLS, node_budget: Optional[int] = 20000,
+                 time_budget: Optional[float] = None, table_size: int = 1 << 18):
+        self.max_depth: int = max_depth
+        self.node_budget: Optional[int] = node_budget
+        self.time_budget: Optional[float] = time_budget
+        self.nodes: int = 0
+        self.exact: bool = False
+        self._deadline: float = 0
+        self._table_size: int = table_size
+        self._table_keys: List[int] = [0] * table_size
+        self._table_depths: List[int] = [0] * table_size
+        self._table_flags: List[int] = [0] * table_size
+        self._table_values: List[int] = [0] * table_size
+        self._table_moves: List[int] = [0] * table_size
+
+    def clear(self):
+        """
+        Clear the transposition table.
+        """
+        self._table_keys = [0] * self._table_size
+
+    def _negamax_(self, current: int, mask: int, moves: int, depth: int, alpha: int, beta: int) -> int:
+        self.nodes += 1
+        if self.node_budget is not None and self.nodes > self.node_budget:
+            raise BudgetExceeded()
+        if self.time_budget is not None and self.nodes & 1023 == 0 and time.perf_counter() > self._deadline:
+            raise BudgetExceeded()
+
+        possible = (mask + bitboard.BOTTOM_MASK) & bitboard.BOARD_MASK
+        for x in CENTER_FIRST:
+            move = possible & COLUMNS[x]
+            if move and bitboard.has_won(current | move):
+                return (bitboard.CELLS + 1 - moves) // 2
+        if moves >= bitboard.CELLS - 1:
+            return 0
+        if depth <= 0:
+            return 0
+
+        alpha_origin = alpha
+        key = current + mask
+        slot = key % self._table_size
+        table_move = -1
+        if self._table_keys[slot] == key:
+            table_move = self._table_moves[slot]
+            if self._table_depths[slot] >= depth:
+                value, flag = self._table_values[slot], self._table_flags[slot]
+                if flag == EXACT:
+                    return value
+                elif flag == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+
+        best, best_move = -bitboard.CELLS, -1
+        order = CENTER_FIRST if table_move < 0 else (table_move,) + tuple(x for x in CENTER_FIRST if x != table_move)
+        opponent = current ^ mask
+        for x in order:
+            move = possible & COLUMNS[x]
+            if not move:
+                continue
+            score = -self._negamax_(opponent, mask | move, moves + 1, depth - 1, -beta, -alpha)
+            if score > best:
+                best, best_move = score, x
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        self._table_keys[slot] = key
+        self._table_depths[slot] = depth
+        self._table_values[slot] = best
+        self._table_moves[slot] = best_move
+        self._table_flags[slot] = UPPER if best <= alpha_origin else (LOWER if best >= beta else EXACT)
+        return best
+
+    def search(self, current: int, mask: int, moves: int) -> Tuple[int, Action]:
+        """
+        Search the best move of the specified position by iterative deepening until the maximum depth is reached,
+        the game is solved or the budget is exceeded.
+
+        Parameters
+        -----------
+        - **current**: the bitboard of the player to move
+        - **mask**: the bitboard of all pieces
+        - **moves**: the number of moves played
+
+        Return
+        -----------
+        The score of the position and the best move found by the deepest completed search.
+        """
+        self.nodes = 0
+        if self.time_budget is not None:
+            self._deadline = time.perf_counter() + self.time_budget
+        possible = (mask + bitboard.BOTTOM_MASK) & bitboard.BOARD_MASK
+        legal = [x for x in CENTER_FIRST if possible & COLUMNS[x]]
+        self.exact = True
+        for x in legal:
+            if bitboard.has_won(current | (possible & COLUMNS[x])):
+                return (bitboard.CELLS + 1 - moves) // 2, x
+
+        best_score, best_move = 0, legal[0]
+        bound = (bitboard.CELLS + 1 - moves) // 2
+        completed = 0
+        for depth in range(1, min(self.max_depth, bitboard.CELLS - moves) + 1):
+            # Search the move found at the previous depth first
+            order = [best_move] + [x for x in legal if x != best_move]
+            alpha, score, move = -bound, -bound, order[0]
+            try:
+                for x in order:
+                    value = -self._negamax_(current ^ mask, mask | (possible & COLUMNS[x]), moves + 1, depth - 1, -bound, -alpha)
+                    if value > score or x == order[0]:
+                        score, move = value, x
+                    alpha = max(alpha, value)
+            except BudgetExceeded:
+                break
+            best_score, best_move = score, move
+            completed = depth
+            if best_score != 0:
+                # A win or a loss is proven
+                break
+        self.exact = best_score != 0 or completed == bitboard.CELLS - moves
+        return best_score, best_move
+
+    def best_action(self, env: ConnectEnvironment) -> Action:
+        """
+        Return the best action found for the player whose turn it is in the specified environment.
+        """
+        mask = env.boards[0] | env.boards[1]
+        return self.search(env.boards[env.turn], mask, env.moves)[1]
+
+
+def solver_policy(max_depth: int = bitboard.CELLS, node_budget: Optional[int] = 20000,
+                  time_budget: Optional[float] = None, table_size: int = 1 << 18) -> Callable[[ConnectEnvironment, Optional[int]], Action]:
+    """
+    Create a policy playing the moves of a ```NegamaxSolver``` for the player whose turn it is.
+    It can be used both as a policy and as a second player with ```attach_second_player```.
+
+    Parameters
+    -----------
+    - **max_depth**: the maximum depth of the search in plies
+    - **node_budget**: the maximum number of nodes explored per move, unlimited if None
+    - **time_budget**: the maximum time spent per move in seconds, unlimited if None
+    - **table_size**: the number of entries of the transposition table
+
+    Return
+    -----------
+    The new solver policy
+    """
+    solver = NegamaxSolver(max_depth, node_budget, time_budget, table_size)
+
+    def f(env: ConnectEnvironment, player: Optional[int] = None) -> Action:
+        return solver.best_action(env)
+    return f
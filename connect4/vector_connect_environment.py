@@ -0,0 +1,193 @@
+from rfl.env.abstract_environment import Action, Episode
+from rfl.policies import BatchPolicy
+from connect4 import bitboard
+
+from typing import Tuple, ClassVar, List, Optional
+
+import numpy as np
+
+
+class VectorConnectEnvironment():
+    """
+    N Connect 4 games stepped at once.
+
+    All boards are stored in stacked arrays: the (N, 2, 7, 6) states exposed to policies, the (N, 2) uint64 bitboards,
+    the (N, 7) column heights, and per game move counter, turn and winner.
+    Every operation (legal moves, applying actions, win detection, reset) is one vectorized operation over the batch.
+
+    The rules and rewards follow ```ConnectEnvironment```: rewards are given from the point of view of **player**
+    and the second player, if attached, plays right after the first one.
+    Without a second player, the given actions are played by the player whose turn it is.
+    """
+
+    action_space: ClassVar[Tuple[Action]] = tuple(range(bitboard.WIDTH))
+
+    def __init__(self, n: int, player: int = 0):
+        self.n: int = n
+        self.player: int = player
+        self.other_player: Optional[BatchPolicy] = None
+        self.play_reward: float = 0
+        self.win_reward: float = 1
+        self.draw_reward: float = 0
+
+        self.states: np.ndarray = np.zeros((n, 2, bitboard.WIDTH, bitboard.HEIGHT), dtype=np.int64)
+        self.boards: np.ndarray = np.zeros((n, 2), dtype=np.uint64)
+        self.heights: np.ndarray = np.zeros((n, bitboard.WIDTH), dtype=np.int64)
+        self.moves: np.ndarray = np.zeros(n, dtype=np.int64)
+        self.turn: np.ndarray = np.zeros(n, dtype=np.int64)
+        self.winner: np.ndarray = np.full(n, -1, dtype=np.int64)
+        self.reset()
+
+    def attach_second_player(self, other_player: BatchPolicy) -> None:
+        """
+        Attach a second player to the environments.
+
+        Parameters
+        -----------
+        - **other_player**: a batch policy called with the states and legal actions masks of the games where it has to play
+        """
+        self.other_player = other_player
+
+    def reset(self, indices: Optional[np.ndarray] = None):
+        """
+        Reset the specified games, all games by default.
+
+        Parameters
+        -----------
+        - **indices**: the indices of the games to reset
+        """
+        if indices is None:
+            indices = np.arange(self.n)
+        self.states[indices] = 0
+        self.boards[indices] = 0
+        self.heights[indices] = 0
+        self.moves[indices] = 0
+        self.turn[indices] = 0
+        self.winner[indices] = -1
+        self._play_second_player_(indices)
+
+    def get_possible_actions_mask(self) -> np.ndarray:
+        """
+        Get the (N, 7) boolean mask of the legal actions of each game.
+        """
+        return self.heights < bitboard.HEIGHT
+
+    def is_closed(self) -> np.ndarray:
+        """
+        Get the (N,) boolean mask of the terminated games.
+        """
+        return self.winner >= 0
+
+    def _push_actions_(self, indices: np.ndarray, actions: np.ndarray) -> np.ndarray:
+        turn = self.turn[indices]
+        y = self.heights[indices, actions]
+        illegal = y >= bitboard.HEIGHT
+        if np.any(illegal):
+            self.winner[indices[illegal]] = 1 - turn[illegal]
+            legal = ~illegal
+            indices, turn, actions, y = indices[legal], turn[legal], actions[legal], y[legal]
+        self.states[indices, turn, actions, y] = 1
+        self.boards[indices, turn] |= np.left_shift(np.uint64(1), (actions * bitboard.H1 + y).astype(np.uint64))
+        self.heights[indices, actions] += 1
+        self.moves[indices] += 1
+        return indices
+
+    def _check_is_closed_from_actions_(self, indices: np.ndarray):
+        turn = self.turn[indices]
+        won = bitboard.has_won(self.boards[indices, turn])
+        self.winner[indices[won]] = turn[won]
+        drawn = ~won & (self.moves[indices] == bitboard.CELLS)
+        self.winner[indices[drawn]] = 9999
+
+    def _play_(self, indices: np.ndarray, actions: np.ndarray) -> np.ndarray:
+        played = self._push_actions_(indices, np.asarray(actions, dtype=np.int64))
+        self._check_is_closed_from_actions_(played)
+        indices = indices[self.winner[indices] < 0]
+        self.turn[indices] = 1 - self.turn[indices]
+        return indices
+
+    def _play_second_player_(self, indices: np.ndarray):
+        if self.other_player is None:
+            return
+        indices = indices[(self.winner[indices] < 0) & (self.turn[indices] != self.player)]
+        if indices.size > 0:
+            actions = self.other_player(self.states[indices], self.get_possible_actions_mask()[indices])
+            self._play_(indices, actions)
+
+    def do_actions(self, actions: np.ndarray) -> np.ndarray:
+        """
+        Do the specified actions in the games which are not closed, games which are closed are left untouched.
+
+        Parameters
+        -----------
+        - **actions**: the (N,) actions, one for each game
+
+        Return
+        -----------
+        The (N,) rewards from doing these actions, 0 for games which were already closed.
+        """
+        indices = np.flatnonzero(self.winner < 0)
+        rewards = np.zeros(self.n, dtype=np.float64)
+        self._play_second_player_(self._play_(indices, actions[indices]))
+
+        rewards[indices] = self.play_reward
+        indices = indices[self.winner[indices] >= 0]
+        winner = self.winner[indices]
+        rewards[indices[winner == self.player]] = self.win_reward
+        rewards[indices[np.abs(winner - self.player) == 1]] = -self.win_reward
+        rewards[indices[winner == 9999]] = self.draw_reward
+        return rewards
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Do the specified actions then reset the games that terminated.
+
+        Parameters
+        -----------
+        - **actions**: the (N,) actions, one for each game
+
+        Return
+        -----------
+        The (N,) rewards and the (N,) boolean mask of the games that terminated and were reset.
+        """
+        rewards = self.do_actions(actions)
+        dones = self.is_closed()
+        self.reset(np.flatnonzero(dones))
+        return rewards, dones
+
+    def do_episodes(self, policy: BatchPolicy, n: int = 1) -> List[Episode]:
+        """
+        Do the specified number of episodes using the specified policy, running up to N games at once.
+
+        Parameters
+        -----------
+        - **policy**: the batch policy to choose the actions, called once per step for all running games
+        - **n**: the number of episodes to run
+
+        Return
+        -----------
+        A list of episodes, an episode is the list of (state, action, reward) from this episode.
+        """
+        episodes = []
+        running: List[Episode] = [[] for _ in range(self.n)]
+        started = min(n, self.n)
+        self.reset()
+        # Games beyond the requested number are never played
+        self.winner[started:] = 9999
+        actions = np.zeros(self.n, dtype=np.int64)
+        while len(episodes) < n:
+            indices = np.flatnonzero(self.winner < 0)
+            states = self.states[indices]
+            actions[indices] = policy(states, self.get_possible_actions_mask()[indices])
+            rewards = self.do_actions(actions)
+            for i, state, action, reward in zip(indices.tolist(), states, actions[indices].tolist(), rewards[indices].tolist()):
+                running[i].append([state, action, reward])
+
+            done = indices[self.winner[indices] >= 0]
+            for i in done.tolist():
+                episodes.append(running[i])
+                running[i] = []
+            restarted = done[:n - started]
+            started += restarted.size
+            self.reset(restarted)
+        return episodes
@@ -24,6 +24,13 @@ class AbstractReplayBuffer(ABC):
         """
         pass
 
+    @abstractmethod
+    def __len__(self) -> int:
+        """
+        Return the number of transitions in this buffer.
+        """
+        pass
+
     @abstractmethod
     def store(self, episodes: List[Episode]):
         """
@@ -34,3 +41,23 @@ class AbstractReplayBuffer(ABC):
         - **episodes**: the list of episodes to be stored
         """
         pass
+
+    def state_dict(self) -> dict:
+        """
+        Return the content of this replay buffer as a dictionary whose large values are numpy arrays, used by checkpoints.
+        The arrays may be shared with the buffer.
+        """
+        raise NotImplementedError("{} does not support checkpoints".format(type(self).__name__))
+
+    def deferred_state_dict(self) -> dict:
+        """
+        Return the content of this replay buffer like ```state_dict```, whose values may be ```Deferred``` computed from
+        a snapshot taken now. Checkpoints compute them in the background.
+        """
+        return self.state_dict()
+
+    def load_state_dict(self, state: dict):
+        """
+        Restore the content of this replay buffer from the specified dictionary produced by ```state_dict```.
+        """
+        raise NotImplementedError("{} does not support checkpoints".format(type(self).__name__))
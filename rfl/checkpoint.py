@@ -0,0 +1,305 @@
+from rfl.learner.abstract_model_learner import AbstractModelLearner
+from rfl.deferred import Deferred, resolve_deferred
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import json
+import os
+import pickle
+import random
+import shutil
+import threading
+import zlib
+
+import torch
+import numpy as np
+
+LATEST_FILE: str = "LATEST"
+MANIFEST_FILE: str = "manifest.json"
+SKELETON_FILE: str = "state.pkl"
+TENSORS_FILE: str = "tensors.pt"
+PREFIX: str = "checkpoint-"
+
+
+class _ArrayRef():
+    __slots__ = ("path",)
+
+    def __init__(self, path: str):
+        self.path = path
+
+
+class _TensorRef():
+    __slots__ = ("path",)
+
+    def __init__(self, path: str):
+        self.path = path
+
+
+class _DeferredRef():
+    __slots__ = ("path", "deferred")
+
+    def __init__(self, path: str, deferred: Deferred):
+        self.path = path
+        self.deferred = deferred
+
+
+def global_random_state() -> dict:
+    return {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+
+
+def set_global_random_state(state: dict):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+
+
+def _split_(state: Any, path: str, arrays: Dict[str, np.ndarray], tensors: Dict[str, torch.Tensor], copy: bool = True) -> Any:
+    """
+    Replace the arrays and tensors of the specified state with references, copying them into the specified dictionaries
+    unless **copy** is False. ```Deferred``` values are kept to be computed by ```_resolve_```.
+    """
+    if isinstance(state, np.ndarray) and state.dtype != object:
+        arrays[path] = np.array(state, copy=copy, order="C")
+        return _ArrayRef(path)
+    if isinstance(state, torch.Tensor):
+        tensors[path] = state.detach().to("cpu", copy=copy)
+        return _TensorRef(path)
+    if isinstance(state, Deferred):
+        return _DeferredRef(path, state)
+    if isinstance(state, dict):
+        return {key: _split_(value, path + "/" + str(key), arrays, tensors, copy) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_split_(value, path + "/" + str(i), arrays, tensors, copy) for i, value in enumerate(state))
+    return state
+
+
+def _resolve_(skeleton: Any, arrays: Dict[str, np.ndarray], tensors: Dict[str, torch.Tensor]) -> Any:
+    """
+    Compute the ```Deferred``` values of the specified skeleton, adding their arrays and tensors to the specified dictionaries.
+    """
+    if isinstance(skeleton, _DeferredRef):
+        # Computed values are not shared with the learner
+        return _split_(resolve_deferred(skeleton.deferred.compute()), skeleton.path, arrays, tensors, copy=False)
+    if isinstance(skeleton, dict):
+        return {key: _resolve_(value, arrays, tensors) for key, value in skeleton.items()}
+    if isinstance(skeleton, (list, tuple)):
+        return type(skeleton)(_resolve_(value, arrays, tensors) for value in skeleton)
+    return skeleton
+
+
+def _join_(state: Any, arrays: Dict[str, np.ndarray], tensors: Dict[str, torch.Tensor]) -> Any:
+    if isinstance(state, _ArrayRef):
+        return arrays[state.path]
+    if isinstance(state, _TensorRef):
+        return tensors[state.path]
+    if isinstance(state, dict):
+        return {key: _join_(value, arrays, tensors) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_join_(value, arrays, tensors) for value in state)
+    return state
+
+
+def _write_file_(path: str, data) -> None:
+    with open(path, "wb") as fd:
+        fd.write(data)
+        fd.flush()
+        os.fsync(fd.fileno())
+
+
+class CheckpointWriter():
+    """
+    Saves checkpoints of a learner into numbered subdirectories of a directory.
+
+    ```save``` takes a snapshot of the state of the learner, copying its arrays and tensors and the containers of the
+    replay buffer, then encodes the replay buffer and writes everything to disk in a background thread so that training
+    goes on meanwhile.
+    A checkpoint is written to a temporary directory renamed once complete, then the ```LATEST``` file is replaced
+    to point to it, so a preempted save never corrupts the previous checkpoint.
+
+    Arrays are written as raw binary chunks, the tensors of the model and optimizer with ```torch.save```, and the
+    small remaining values are pickled.
+    Saves are incremental: a chunk whose checksum equals the one of the same chunk in the previous checkpoint is
+    hard linked instead of written again, so the unchanged parts of a large replay buffer cost no I/O.
+
+    Parameters
+    -----------
+    - **directory**: the directory of the checkpoints, created if it does not exist
+    - **keep**: the number of most recent checkpoints kept
+    - **chunk_size**: the size in bytes of the chunks of the arrays
+    """
+
+    def __init__(self, directory: str, keep: int = 2, chunk_size: int = 1 << 26):
+        self.directory: str = directory
+        self.keep: int = keep
+        self.chunk_size: int = chunk_size
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        os.makedirs(directory, exist_ok=True)
+        # Leftovers of interrupted saves
+        for name in os.listdir(directory):
+            if name.startswith(".tmp-"):
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    def save(self, learner: AbstractModelLearner, step: Optional[int] = None, extra: Optional[dict] = None,
+             background: bool = True):
+        """
+        Save a checkpoint of the specified learner, along with the states of the global random generators.
+        If a previous save is still being written, wait for it first.
+
+        Parameters
+        -----------
+        - **learner**: the learner to be saved
+        - **step**: the step of training saved in the checkpoint, the model version of the learner by default
+        - **extra**: any additional picklable values saved in the checkpoint
+        - **background**: whether to write the checkpoint in a background thread
+        """
+        self.wait()
+        # Only a snapshot is taken here, the values of the replay buffer that are slow to encode are computed when writing
+        state = {"step": learner.model_version if step is None else step, "learner": learner.state_dict(deferred=True),
+                 "random": global_random_state(), "extra": extra or {}}
+        arrays: Dict[str, np.ndarray] = {}
+        tensors: Dict[str, torch.Tensor] = {}
+        skeleton = _split_(state, "", arrays, tensors)
+        if background:
+            self._thread = threading.Thread(target=self._run_, args=(skeleton, arrays, tensors), daemon=True)
+            self._thread.start()
+        else:
+            self._write_(skeleton, arrays, tensors)
+
+    def wait(self):
+        """
+        Wait for the checkpoint being written, if any, and raise the error it failed with.
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run_(self, skeleton: Any, arrays: Dict[str, np.ndarray], tensors: Dict[str, torch.Tensor]):
+        try:
+            self._write_(skeleton, arrays, tensors)
+        except BaseException as e:
+            self._error = e
+
+    def _write_(self, skeleton: Any, arrays: Dict[str, np.ndarray], tensors: Dict[str, torch.Tensor]):
+        skeleton = _resolve_(skeleton, arrays, tensors)
+        previous = latest_checkpoint(self.directory)
+        previous_chunks: Dict[Tuple[str, int], Tuple[int, int, str]] = {}
+        if previous is not None:
+            with open(os.path.join(previous, MANIFEST_FILE)) as fd:
+                for path, entry in json.load(fd)["arrays"].items():
+                    for i, (file, size, crc) in enumerate(entry["chunks"]):
+                        previous_chunks[(path, i)] = (size, crc, os.path.join(previous, file))
+
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith(PREFIX))
+        number = int(names[-1][len(PREFIX):]) + 1 if names else 0
+        name = "{}{:08d}".format(PREFIX, number)
+        tmp = os.path.join(self.directory, ".tmp-" + name)
+        os.makedirs(tmp)
+
+        manifest = {"arrays": {}}
+        for k, (path, array) in enumerate(arrays.items()):
+            data = memoryview(array.reshape(-1)).cast("B")
+            chunks = []
+            for i, start in enumerate(range(0, data.nbytes, self.chunk_size)):
+                chunk = data[start:start + self.chunk_size]
+                file = "{}.{}.bin".format(k, i)
+                size, crc = chunk.nbytes, zlib.crc32(chunk)
+                old = previous_chunks.get((path, i))
+                if old is not None and old[0] == size and old[1] == crc:
+                    try:
+                        os.link(old[2], os.path.join(tmp, file))
+                    except OSError:
+                        shutil.copyfile(old[2], os.path.join(tmp, file))
+                else:
+                    _write_file_(os.path.join(tmp, file), chunk)
+                chunks.append((file, size, crc))
+            manifest["arrays"][path] = {"dtype": array.dtype.str, "shape": list(array.shape), "chunks": chunks}
+
+        with open(os.path.join(tmp, TENSORS_FILE), "wb") as fd:
+            torch.save(tensors, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        _write_file_(os.path.join(tmp, SKELETON_FILE), pickle.dumps(skeleton, protocol=pickle.HIGHEST_PROTOCOL))
+        _write_file_(os.path.join(tmp, MANIFEST_FILE), json.dumps(manifest).encode())
+
+        os.rename(tmp, os.path.join(self.directory, name))
+        _write_file_(os.path.join(self.directory, LATEST_FILE + ".tmp"), name.encode())
+        os.replace(os.path.join(self.directory, LATEST_FILE + ".tmp"), os.path.join(self.directory, LATEST_FILE))
+        for old_name in (names + [name])[:-self.keep]:
+            shutil.rmtree(os.path.join(self.directory, old_name), ignore_errors=True)
+
+
+def latest_checkpoint(directory: str) -> Optional[str]:
+    """
+    Return the path of the latest complete checkpoint in the specified directory, None if there is none.
+    """
+    try:
+        with open(os.path.join(directory, LATEST_FILE)) as fd:
+            name = fd.read().strip()
+    except FileNotFoundError:
+        return None
+    path = os.path.join(directory, name)
+    return path if os.path.isdir(path) else None
+
+
+def read_checkpoint(path: str, map_location: str = "cpu") -> dict:
+    """
+    Read the checkpoint at the specified path.
+
+    Return
+    -----------
+    The dictionary (step, learner, random, extra).
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as fd:
+        manifest = json.load(fd)
+    arrays: Dict[str, np.ndarray] = {}
+    for array_path, entry in manifest["arrays"].items():
+        array = np.empty(entry["shape"], dtype=np.dtype(entry["dtype"]))
+        data = memoryview(array.reshape(-1)).cast("B")
+        offset = 0
+        for (file, size, _) in entry["chunks"]:
+            with open(os.path.join(path, file), "rb") as fd:
+                fd.readinto(data[offset:offset + size])
+            offset += size
+        arrays[array_path] = array
+    tensors = torch.load(os.path.join(path, TENSORS_FILE), map_location=map_location)
+    with open(os.path.join(path, SKELETON_FILE), "rb") as fd:
+        skeleton = pickle.load(fd)
+    return _join_(skeleton, arrays, tensors)
+
+
+def save_checkpoint(learner: AbstractModelLearner, directory: str, step: Optional[int] = None, extra: Optional[dict] = None,
+                    keep: int = 2):
+    """
+    Save a checkpoint of the specified learner in the specified directory and wait for it to be written.
+    See ```CheckpointWriter``` to save in the background.
+    """
+    CheckpointWriter(directory, keep).save(learner, step, extra, background=False)
+
+
+def load_checkpoint(learner: AbstractModelLearner, directory: str, restore_random: bool = True) -> Optional[dict]:
+    """
+    Restore the specified learner from the latest checkpoint of the specified directory.
+    ```setup_training``` must have been called before for the optimizer state to be restored.
+
+    Parameters
+    -----------
+    - **learner**: the learner to be restored
+    - **directory**: the directory of the checkpoints
+    - **restore_random**: whether to restore the states of the global random generators
+
+    Return
+    -----------
+    The dictionary (step, extra) of the checkpoint, None if there is no checkpoint.
+    """
+    path = latest_checkpoint(directory)
+    if path is None:
+        return None
+    state = read_checkpoint(path, getattr(learner, "device", "cpu"))
+    learner.load_state_dict(state["learner"])
+    if restore_random:
+        set_global_random_state(state["random"])
+    return {"step": state["step"], "extra": state["extra"]}
@@ -0,0 +1,41 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache():
+    """
+    Bounded mapping that evicts the least recently used entry when full, counting hits and misses.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity: int = capacity
+        self.hits: int = 0
+        self.misses: int = 0
+        self._dict: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the value of the specified key or None if it is not in the cache.
+        """
+        value = self._dict.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._dict.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._dict[key] = value
+        self._dict.move_to_end(key)
+        if len(self._dict) > self.capacity:
+            self._dict.popitem(last=False)
+
+    def clear(self):
+        self._dict.clear()
+
+    def __len__(self) -> int:
+        return len(self._dict)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._dict
@@ -1,19 +1,30 @@
 
 
-from typing import Dict, List, Any
+from typing import Callable, Dict, List, Any
+
+import numpy as np
 
 UID = int
 
 
 class RefCountedList():
+    """
+    Elements counting their references, an element is removed once it has none.
+
+    Parameters
+    -----------
+    - **recycle**: whether the uids of removed elements are given to new elements, otherwise uids increase monotonically
+    and never identify two elements
+    """
 
-    def __init__(self):
+    def __init__(self, recycle: bool = True):
+        self._recycle: bool = recycle
         self._dict: Dict[UID, Any] = {}
         self._max_uid: UID = 0
         self._free_uid: List[UID] = []
 
     def __get_uid(self) -> UID:
-        if self._free_uid:
+        if self._recycle and self._free_uid:
             return self._free_uid.pop()
         uid: UID = self._max_uid
         self._max_uid += 1
@@ -32,10 +43,37 @@ class RefCountedList():
         tup[1] -= removed_refs
         if tup[1] <= 0:
             del self._dict[uid]
-            self._free_uid.append(uid)
+            if self._recycle:
+                self._free_uid.append(uid)
             return True
         return False
 
+    def snapshot(self) -> "RefCountedList":
+        """
+        Return a copy of this list sharing its elements, which are not modified by later changes to the references.
+        """
+        copied = RefCountedList(self._recycle)
+        copied._dict = {uid: [element, refs] for uid, (element, refs) in self._dict.items()}
+        copied._max_uid = self._max_uid
+        copied._free_uid = list(self._free_uid)
+        return copied
+
+    def state_dict(self, encode: Callable[[List[Any]], dict]) -> dict:
+        """
+        Return the state of this list, its elements being encoded at once by the specified function.
+        """
+        uids = list(self._dict.keys())
+        return {"uids": np.asarray(uids, dtype=np.int64),
+                "refs": np.asarray([self._dict[uid][1] for uid in uids], dtype=np.int64),
+                "max_uid": self._max_uid, "free_uid": np.asarray(self._free_uid, dtype=np.int64),
+                "elements": encode([self._dict[uid][0] for uid in uids])}
+
+    def load_state_dict(self, state: dict, decode: Callable[[dict], List[Any]]):
+        elements = decode(state["elements"])
+        self._dict = {uid: [element, refs] for uid, refs, element in zip(state["uids"].tolist(), state["refs"].tolist(), elements)}
+        self._max_uid = state["max_uid"]
+        self._free_uid = state["free_uid"].tolist()
+
     def tolist(self) -> List[Any]:
         return [el for (el, _) in self._dict.values()]
 
@@ -1,4 +1,4 @@
-from typing import Callable, Any
+from typing import Callable, Any, List, Tuple
 
 
 class SortedList():
@@ -10,23 +10,42 @@ class SortedList():
     def __getitem__(self, key):
         return self._list.__getitem__(key)
 
+    def __delitem__(self, key):
+        self._list.__delitem__(key)
+
     def _bissect(self, value, start=None, end=None):
         '''
-        key(list[a]) <= value < key(list[b])
+        key(list[a]) <= value < key(list[b]) with b = a + 1, b being the position where an item with this key is inserted
         '''
-        a = start or 0
-        b = end or len(self._list)
-        c = (a + b) // 2
-        while b - a > 1:
-            compared = self._key(self._list[c])
-            if compared < value:
-                b = c
-            elif compared > value:
-                a = c
+        a = 0 if start is None else start
+        b = len(self._list) if end is None else end
+        while a < b:
+            c = (a + b) // 2
+            if self._key(self._list[c]) <= value:
+                a = c + 1
             else:
-                return c, c + 1
+                b = c
+        return a - 1, a
+
+    def equal_range(self, value) -> Tuple[int, int]:
+        """
+        Return the range [start, end) of the indices of the items whose key equals the specified value.
+        """
+        _, end = self._bissect(value)
+        a, b = 0, end
+        while a < b:
             c = (a + b) // 2
-        return a, b
+            if self._key(self._list[c]) < value:
+                a = c + 1
+            else:
+                b = c
+        return a, end
+
+    def set_sorted(self, items: List[Any]):
+        """
+        Replace the content of this list with the specified items, which must already be sorted.
+        """
+        self._list = list(items)
 
     def append(self, item: Any):
         value = self._key(item)
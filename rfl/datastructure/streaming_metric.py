@@ -0,0 +1,138 @@
+from typing import Callable, Dict, Iterator, Optional, Union
+
+import math
+
+import numpy as np
+
+
+class StreamingMetric():
+    """
+    Bounded record of a scalar metric.
+
+    The last **window** values are kept in a preallocated ring buffer, the count, mean, variance (Welford), min, max
+    and an exponential moving average are kept over all the values ever appended.
+    Every **downsample** values, the mean, min and max of the block are passed to **on_block** if given.
+    It can be read like the list it replaces: ```len```, indexing, iteration and ```np.asarray``` give the values
+    of the window from the oldest to the newest.
+
+    Parameters
+    -----------
+    - **name**: the name of the metric
+    - **window**: the number of most recent values kept
+    - **ema**: the smoothing factor of the exponential moving average
+    - **downsample**: the number of values per block passed to **on_block**
+    - **on_block**: called with the metric and the statistics of every completed block
+    """
+
+    def __init__(self, name: str = "", window: int = 10000, ema: float = .01, downsample: int = 1000,
+                 on_block: Optional[Callable[["StreamingMetric", Dict[str, float]], None]] = None):
+        self.name: str = name
+        self.window: int = window
+        self.ema_factor: float = ema
+        self.downsample: int = downsample
+        self.on_block = on_block
+        self._values: np.ndarray = np.zeros(window, dtype=np.float64)
+        self.clear()
+
+    def clear(self):
+        self.count: int = 0
+        self.mean: float = 0
+        self._m2: float = 0
+        self.min: float = math.inf
+        self.max: float = -math.inf
+        self.ema: float = 0
+        self._block_sum: float = 0
+        self._block_min: float = math.inf
+        self._block_max: float = -math.inf
+        self._block_count: int = 0
+
+    def append(self, value: float):
+        value = float(value)
+        self._values[self.count % self.window] = value
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.ema = value if self.count == 1 else self.ema + self.ema_factor * (value - self.ema)
+
+        self._block_sum += value
+        self._block_count += 1
+        if value < self._block_min:
+            self._block_min = value
+        if value > self._block_max:
+            self._block_max = value
+        if self._block_count == self.downsample:
+            if self.on_block is not None:
+                self.on_block(self, {"count": self.count, "mean": self._block_sum / self._block_count,
+                                     "min": self._block_min, "max": self._block_max})
+            self._block_sum, self._block_min, self._block_max, self._block_count = 0, math.inf, -math.inf, 0
+
+    _FIELDS = ("count", "mean", "_m2", "min", "max", "ema", "_block_sum", "_block_min", "_block_max", "_block_count")
+
+    def state_dict(self) -> dict:
+        state = {field: getattr(self, field) for field in self._FIELDS}
+        state["values"] = self._values
+        return state
+
+    def load_state_dict(self, state: dict):
+        for field in self._FIELDS:
+            setattr(self, field, state[field])
+        # The window may have a different size than the saved one, the most recent values are kept
+        values = state["values"]
+        saved = min(self.count, values.shape[0])
+        if self.count > values.shape[0]:
+            values = np.roll(values, -(self.count % values.shape[0]))
+        kept = values[:saved][-self.window:]
+        self._values[np.arange(self.count - kept.shape[0], self.count) % self.window] = kept
+
+    @property
+    def var(self) -> float:
+        return self._m2 / self.count if self.count > 0 else 0
+
+    @property
+    def std(self) -> float:
+        return np.sqrt(self.var)
+
+    def values(self) -> np.ndarray:
+        """
+        Return a copy of the values of the window from the oldest to the newest.
+        """
+        if self.count <= self.window:
+            return self._values[:self.count].copy()
+        start = self.count % self.window
+        return np.concatenate((self._values[start:], self._values[:start]))
+
+    def window_stats(self) -> Dict[str, float]:
+        """
+        Return the mean, standard deviation, min, max, p50, p95 and p99 of the values of the window.
+        """
+        values = self._values[:min(self.count, self.window)]
+        if values.shape[0] == 0:
+            return {}
+        p50, p95, p99 = np.percentile(values, (50, 95, 99))
+        return {"mean": float(np.mean(values)), "std": float(np.std(values)), "min": float(np.min(values)),
+                "max": float(np.max(values)), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+    def summary(self) -> Dict[str, Union[int, float, Dict[str, float]]]:
+        """
+        Return the running aggregates over all values and the statistics of the window.
+        """
+        return {"count": self.count, "mean": self.mean, "std": self.std, "min": self.min, "max": self.max,
+                "ema": self.ema, "window": self.window_stats()}
+
+    def __len__(self) -> int:
+        return min(self.count, self.window)
+
+    def __getitem__(self, index):
+        return self.values()[index]
+
+    def __iter__(self) -> Iterator[float]:
+        return iter(self.values().tolist())
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        values = self.values()
+        return values if dtype is None else values.astype(dtype)
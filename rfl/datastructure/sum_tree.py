@@ -0,0 +1,129 @@
+from typing import Callable
+
+import numpy as np
+
+
+class SegmentTree():
+    """
+    Complete binary tree stored in an array where each inner node is the reduction of its two children.
+    Leaves are addressed by their index in [0, capacity), the root is at index 1.
+    """
+
+    def __init__(self, capacity: int, operation: Callable[[np.ndarray, np.ndarray], np.ndarray], neutral: float):
+        self.capacity: int = capacity
+        self._operation = operation
+        self._neutral: float = neutral
+        self._leaves: int = 1 << max(0, (capacity - 1).bit_length())
+        self._tree: np.ndarray = np.full(2 * self._leaves, neutral, dtype=np.float64)
+        self._levels: np.ndarray = np.arange(self._leaves.bit_length(), dtype=np.int64)
+
+    def __getitem__(self, indices):
+        return self._tree[np.asarray(indices) + self._leaves]
+
+    def __setitem__(self, index: int, value: float):
+        # Nodes from the leaf to the root, each one is the reduction of the value with the siblings below it
+        path = (index + self._leaves) >> self._levels
+        values = np.empty(path.shape[0], dtype=np.float64)
+        values[0] = value
+        values[1:] = self._tree[path[:-1] ^ 1]
+        self._tree[path] = self._operation.accumulate(values)
+
+    def update(self, indices: np.ndarray, values: np.ndarray):
+        """
+        Set the values of the specified leaves, for duplicate indices the last value is kept.
+
+        Parameters
+        -----------
+        - **indices**: the indices of the leaves
+        - **values**: the new values of the leaves
+        """
+        nodes = np.asarray(indices, dtype=np.int64) + self._leaves
+        self._tree[nodes] = values
+        # Duplicate parents are recomputed to the same value, which is cheaper than removing them
+        for _ in range(self._leaves.bit_length() - 1):
+            nodes >>= 1
+            self._tree[nodes] = self._operation(self._tree[2 * nodes], self._tree[2 * nodes + 1])
+
+    def reduce(self) -> float:
+        """
+        Return the reduction of all the leaves.
+        """
+        return self._tree[1]
+
+    def clear(self):
+        self._tree.fill(self._neutral)
+
+    def state_dict(self) -> dict:
+        return {"tree": self._tree}
+
+    def load_state_dict(self, state: dict):
+        self._tree[:] = state["tree"]
+
+
+class SumTree(SegmentTree):
+
+    def __init__(self, capacity: int):
+        super(SumTree, self).__init__(capacity, np.add, 0.0)
+
+    def total(self) -> float:
+        return self._tree[1]
+
+    def find_prefix_sum(self, values: np.ndarray) -> np.ndarray:
+        """
+        Find for each value the leaf i such that sum(leaves[:i]) <= value < sum(leaves[:i+1]).
+        Leaves with a value of 0 are never returned.
+
+        Parameters
+        -----------
+        - **values**: the prefix sums to look for, in [0, total())
+
+        Return
+        -----------
+        The indices of the leaves.
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(values.shape[0], dtype=np.int64)
+        tree = self._tree
+        for _ in range(self._leaves.bit_length() - 1):
+            left = 2 * nodes
+            left_sums = tree[left]
+            right = (values >= left_sums) & (tree[left + 1] > 0)
+            values -= left_sums * right
+            nodes = left + right
+        return nodes - self._leaves
+
+    def sample(self, size: int, generator: np.random.Generator) -> np.ndarray:
+        """
+        Stratified sampling of leaves proportionally to their values.
+        The total is split in **size** segments of equal mass and one leaf is sampled uniformly in each segment.
+
+        Parameters
+        -----------
+        - **size**: the number of leaves to sample
+        - **generator**: the PRNG to be used
+
+        Return
+        -----------
+        The indices of the sampled leaves.
+        """
+        segment = self.total() / size
+        return self.find_prefix_sum((np.arange(size) + generator.uniform(size=size)) * segment)
+
+
+class MinTree(SegmentTree):
+
+    def __init__(self, capacity: int):
+        super(MinTree, self).__init__(capacity, np.minimum, np.inf)
+
+    def min(self) -> float:
+        return self._tree[1]
+
+    def argmin(self) -> int:
+        """
+        Return the index of a leaf with the minimum value.
+        """
+        tree = self._tree
+        i = 1
+        while i < self._leaves:
+            i = 2 * i if tree[2 * i] <= tree[2 * i + 1] else 2 * i + 1
+        return i - self._leaves
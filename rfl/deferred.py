@@ -0,0 +1,30 @@
+from typing import Any, Callable
+
+
+class Deferred():
+    """
+    Value of a state dictionary computed when it is needed, from a snapshot taken when the state was built.
+    ```CheckpointWriter``` computes them in its background thread, so that the encoding of large Python structures
+    does not pause training.
+
+    Parameters
+    -----------
+    - **compute**: the function computing the value, it must only use values that are not modified afterwards
+    """
+    __slots__ = ("compute",)
+
+    def __init__(self, compute: Callable[[], Any]):
+        self.compute: Callable[[], Any] = compute
+
+
+def resolve_deferred(state: Any) -> Any:
+    """
+    Return the specified state with its ```Deferred``` values computed.
+    """
+    if isinstance(state, Deferred):
+        return resolve_deferred(state.compute())
+    if isinstance(state, dict):
+        return {key: resolve_deferred(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(resolve_deferred(value) for value in state)
+    return state
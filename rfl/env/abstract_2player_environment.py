@@ -1,26 +1,33 @@
 from rfl.env.abstract_environment import AbstractEnvironment, Action, State
+from rfl.instrumentation import Instrumentation, NULL_INSTRUMENTATION
 
 from abc import ABC, abstractmethod
 from typing import Callable
 
+import numpy as np
+
 
 class Abstract2PlayerEnvironment(AbstractEnvironment, ABC):
 
     def __init__(self, initial_state: State, player: int = 0):
         super(Abstract2PlayerEnvironment, self).__init__(initial_state)
         self._initial_board = initial_state.copy()
-        self.player: int = 0
+        self.player: int = player
         self.turn: int = 0
         self.other_player: Callable[[State, int], int] = None
         self.winner: int = -1
         self.play_reward: float = 0
         self.win_reward: float = 1
         self.draw_reward: float = 0
+        self.instrumentation: Instrumentation = NULL_INSTRUMENTATION
 
     def reset(self):
         self.set_state(self._initial_board.copy())
         self.turn = 0
         self.winner = -1
+        # The second player opens the game when the player of this environment plays second
+        if self.other_player is not None:
+            self.play_second_player()
 
     @abstractmethod
     def get_flipped_state_copy(self) -> State:
@@ -57,7 +64,11 @@ class Abstract2PlayerEnvironment(AbstractEnvironment, ABC):
         Play one turn of the second player.
         """
         if not self.is_closed() and self.turn != self.player:
-            self.do_action(self.other_player(self, self.turn))
+            if self.other_player is None:
+                raise RuntimeError("it is the turn of the second player but none is attached, see attach_second_player")
+            with self.instrumentation.timer("env.second_player"):
+                action = self.other_player(self, self.turn)
+            self.do_action(action)
 
     @abstractmethod
     def _push_action_(self, action: Action):
@@ -104,6 +115,55 @@ class Abstract2PlayerEnvironment(AbstractEnvironment, ABC):
     def is_closed(self) -> bool:
         return self.winner >= 0
 
+    def make_move(self, action: Action):
+        """
+        Play the specified action for the player whose turn it is, the second player does not answer.
+        It must be undone with ```unmake_move```, moves are undone in the reverse order they were made.
+        This default implementation saves the whole state, environments should override it with a cheaper undo.
+
+        Parameters
+        -----------
+        - **action**: the action to be taken
+        """
+        self.push()
+        self._push_action_(action)
+        self._check_is_closed_from_action_(action)
+        if not self.is_closed():
+            self.next_turn()
+
+    def unmake_move(self):
+        """
+        Undo the last move made with ```make_move```.
+        """
+        self.pop()
+
+    def get_winning_actions_mask(self, states: np.ndarray) -> np.ndarray:
+        """
+        Get for each of the specified states which actions win the game for the player whose turn it is.
+        This default implementation plays every legal action with ```make_move```, it assumes ```set_state``` restores
+        the turn, environments should override it with a vectorized version.
+
+        Parameters
+        -----------
+        - **states**: the batch of states of games that are not over
+
+        Return
+        -----------
+        The (N, len(action_space)) boolean mask of the winning actions.
+        """
+        mask = np.zeros((states.shape[0], len(self.action_space)), dtype=bool)
+        self.push()
+        for i, state in enumerate(states):
+            self.set_state(state.copy())
+            self.winner = -1
+            mover = self.turn
+            for action in self.get_possible_actions():
+                self.make_move(action)
+                mask[i, self.action_space.index(action)] = self.is_closed() and self.winner == mover
+                self.unmake_move()
+        self.pop()
+        return mask
+
     def push(self):
         self._saves.append([self.get_state_copy(), self.turn, self.winner])
 
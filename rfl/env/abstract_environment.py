@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Callable, ClassVar, TypeVar, Tuple, Iterable
+from typing import List, Callable, ClassVar, TypeVar, Tuple, Iterable, Hashable
 
 import numpy as np
 
@@ -66,6 +66,56 @@ class AbstractEnvironment(ABC):
         self.pop()
         return output
 
+    def get_state_keys(self, states: np.ndarray) -> List[Hashable]:
+        """
+        Get hashable keys identifying the specified states, states that are equivalent for this environment share a key.
+        """
+        return [state.tobytes() for state in states]
+
+    def get_states_with_actions(self, states: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get for each of the specified states the states obtained by taking each action of the action space.
+
+        Parameters
+        -----------
+        - **states**: the batch of states
+
+        Return
+        -----------
+        The (N, len(action_space), ...) successor states, padded with the original state for illegal actions,
+        and the (N, len(action_space)) boolean mask of the legal actions.
+        """
+        successors = np.repeat(states[:, np.newaxis], len(self.action_space), axis=1)
+        mask = np.zeros((states.shape[0], len(self.action_space)), dtype=bool)
+        self.push()
+        for i, state in enumerate(states):
+            self.set_state(state.copy())
+            for action in self.get_possible_actions():
+                j = self.action_space.index(action)
+                successors[i, j] = self.get_state_with_action(state.copy(), action)
+                mask[i, j] = True
+        self.pop()
+        return successors, mask
+
+    def write_states_with_actions(self, out: np.ndarray, mask: np.ndarray):
+        """
+        Write into the specified buffers the state of this environment with each action of the action space taken,
+        used to evaluate moves without allocating arrays.
+        This default implementation copies states, environments should override it to write the buffers in place.
+
+        Parameters
+        -----------
+        - **out**: the (len(action_space), ...) buffer of states, rows of illegal actions hold the current state
+        - **mask**: the (len(action_space),) boolean buffer of the legal actions
+        """
+        state = self.get_state_copy()
+        out[:] = state
+        mask[:] = False
+        for action in self.get_possible_actions():
+            j = self.action_space.index(action)
+            out[j] = self.get_state_with_action(state.copy(), action)
+            mask[j] = True
+
     @abstractmethod
     def do_action(self, action: Action) -> float:
         """
@@ -0,0 +1,129 @@
+from rfl.instrumentation import Instrumentation, NULL_INSTRUMENTATION
+
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+import asyncio
+import threading
+import queue
+import time
+
+import numpy as np
+
+# Maps a batch of inputs to the batch of their outputs
+BatchEvaluation = Callable[[np.ndarray], np.ndarray]
+
+
+class InferenceServer():
+    """
+    Thread evaluating the inputs submitted by many concurrent callers in batches.
+
+    Each request is a batch of one or more inputs.
+    The server waits for a request, then coalesces the requests that arrive within **max_wait** seconds until
+    **max_batch_size** inputs are gathered, evaluates all of them in one call and gives each caller its own outputs.
+    Requests are submitted from threads with ```submit``` or ```evaluate```, and from coroutines with ```evaluate_async```.
+
+    Parameters
+    -----------
+    - **evaluate**: the function evaluating a batch of inputs, only called from the thread of the server
+    - **max_batch_size**: the number of inputs above which no more requests are added to a batch
+    - **max_wait**: the maximum time in seconds spent waiting for more requests once a batch is started
+    """
+
+    def __init__(self, evaluate: BatchEvaluation, max_batch_size: int = 256, max_wait: float = .001):
+        self._evaluate = evaluate
+        self.max_batch_size: int = max_batch_size
+        self.max_wait: float = max_wait
+        self.instrumentation: Instrumentation = NULL_INSTRUMENTATION
+        self.batches: int = 0
+        self.requests: int = 0
+        self.inputs: int = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "InferenceServer":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._serve_, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the server once the requests already submitted are served.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "InferenceServer":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.inputs / max(1, self.batches)
+
+    def submit(self, inputs: np.ndarray) -> Future:
+        """
+        Submit the specified batch of inputs.
+
+        Return
+        -----------
+        The future of the batch of their outputs.
+        """
+        if self._thread is None:
+            raise RuntimeError("the inference server is not started")
+        future = Future()
+        self._queue.put((np.asarray(inputs), future))
+        return future
+
+    def evaluate(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Submit the specified batch of inputs and wait for their outputs.
+        """
+        return self.submit(inputs).result()
+
+    async def evaluate_async(self, inputs: np.ndarray) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(inputs))
+
+    def _serve_(self):
+        running = True
+        while running:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch: List[Tuple[np.ndarray, Future]] = [request]
+            size = request[0].shape[0]
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    running = False
+                    break
+                batch.append(request)
+                size += request[0].shape[0]
+            self._run_batch_(batch)
+
+    def _run_batch_(self, batch: List[Tuple[np.ndarray, Future]]):
+        try:
+            with self.instrumentation.timer("inference.batch"):
+                outputs = self._evaluate(np.concatenate([inputs for (inputs, _) in batch]))
+        except BaseException as e:
+            for (_, future) in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.requests += len(batch)
+        start = 0
+        for (inputs, future) in batch:
+            end = start + inputs.shape[0]
+            future.set_result(outputs[start:end])
+            start = end
+        self.inputs += start
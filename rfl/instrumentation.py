@@ -0,0 +1,180 @@
+from typing import Dict, Optional
+
+import json
+import threading
+import time
+
+import numpy as np
+
+
+class _Timer():
+    __slots__ = ("_instrumentation", "_name", "_start")
+
+    def __init__(self, instrumentation: "Instrumentation", name: str):
+        self._instrumentation = instrumentation
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._instrumentation.record(self._name, time.perf_counter() - self._start)
+
+
+class _NullTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Instrumentation():
+    """
+    Timers and counters of the phases of training.
+
+    The durations of the last **window** calls of each phase are kept in a preallocated ring buffer to compute percentiles,
+    along with the total number of calls and total duration.
+    It is thread safe, so that the actors of ```run_pipeline``` share the instrumentation of their learner.
+    If a path is given, a summary is appended to it as one JSON line every **interval** seconds, checked by ```tick```.
+
+    Parameters
+    -----------
+    - **window**: the number of durations kept per phase
+    - **path**: the JSONL file summaries are appended to, None to disable periodic export
+    - **interval**: the minimum number of seconds between two periodic summaries
+    - **verbose**: whether to also print the periodic summaries
+    """
+
+    enabled: bool = True
+
+    def __init__(self, window: int = 10000, path: Optional[str] = None, interval: float = 60, verbose: bool = False):
+        self.window: int = window
+        self.path: Optional[str] = path
+        self.interval: float = interval
+        self.verbose: bool = verbose
+        self._durations: Dict[str, np.ndarray] = {}
+        self._calls: Dict[str, int] = {}
+        self._totals: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self._last_export: float = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def timer(self, name: str):
+        """
+        Return a context manager recording the time spent in it under the specified phase name.
+        """
+        return _Timer(self, name)
+
+    def record(self, name: str, duration: float):
+        """
+        Record one call of the specified phase that took the specified duration in seconds.
+        """
+        with self._lock:
+            calls = self._calls.get(name, 0)
+            if calls == 0:
+                self._durations[name] = np.zeros(self.window, dtype=np.float64)
+                self._totals[name] = 0
+            self._durations[name][calls % self.window] = duration
+            self._calls[name] = calls + 1
+            self._totals[name] += duration
+
+    def count(self, name: str, n: int = 1):
+        """
+        Add n to the specified counter.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Return for each phase its number of calls, total time in seconds and mean, p50, p95 and p99 durations in milliseconds
+        over the window.
+        """
+        with self._lock:
+            phases = [(name, calls, self._durations[name][:min(calls, self.window)] * 1000, self._totals[name])
+                      for name, calls in self._calls.items()]
+        output = {}
+        for name, calls, durations, total in phases:
+            p50, p95, p99 = np.percentile(durations, (50, 95, 99))
+            output[name] = {"calls": calls, "total_s": total, "mean_ms": float(np.mean(durations)),
+                            "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+        return output
+
+    def export_jsonl(self, path: str):
+        """
+        Append the summary and the counters to the specified file as one JSON line.
+        """
+        phases = self.summary()
+        with self._lock:
+            counters = dict(self.counters)
+        with open(path, "a") as fd:
+            fd.write(json.dumps({"time": time.time(), "phases": phases, "counters": counters}) + "\n")
+
+    def format_summary(self) -> str:
+        lines = ["{:<32} {:>10} {:>10} {:>10} {:>10} {:>10}".format("phase", "calls", "total(s)", "p50(ms)", "p95(ms)", "p99(ms)")]
+        for name, stats in sorted(self.summary().items()):
+            lines.append("{:<32} {:>10} {:>10.2f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+                name, stats["calls"], stats["total_s"], stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]))
+        return "\n".join(lines)
+
+    def tick(self):
+        """
+        Export the summary if the interval has elapsed since the last export.
+        """
+        now = time.perf_counter()
+        if now - self._last_export < self.interval:
+            return
+        self._last_export = now
+        if self.path:
+            self.export_jsonl(self.path)
+        if self.verbose:
+            print(self.format_summary())
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._calls.clear()
+            self._totals.clear()
+            self.counters.clear()
+
+
+class NullInstrumentation(Instrumentation):
+    """
+    Disabled instrumentation, every method is a no-op and timers are one shared no-op context manager.
+    """
+
+    enabled: bool = False
+
+    def __init__(self):
+        super(NullInstrumentation, self).__init__(window=0)
+
+    def timer(self, name: str):
+        return _NULL_TIMER
+
+    def record(self, name: str, duration: float):
+        pass
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+    def tick(self):
+        pass
+
+
+NULL_INSTRUMENTATION: Instrumentation = NullInstrumentation()
@@ -1,10 +1,43 @@
-from rfl.env.abstract_environment import AbstractEnvironment, Episode
+from rfl.env.abstract_environment import AbstractEnvironment, Action, Episode
 from rfl.abstract_replay_buffer import AbstractReplayBuffer
 from rfl.policies import Policy
+from rfl.instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from rfl.metrics_store import MetricsStore
 
-from typing import List
+from typing import List, Callable, Optional
 
 from abc import ABC, abstractmethod
+import multiprocessing
+import threading
+import queue
+import copy
+
+import numpy as np
+
+# Builds the policy of a worker from its own copy of the learner and its seed
+PolicyFactory = Callable[["AbstractModelLearner", int], Policy]
+# Builds the second player of an actor from its seed, see ```Abstract2PlayerEnvironment.attach_second_player```
+OpponentFactory = Callable[[int], Callable[[AbstractEnvironment, int], Action]]
+
+# Learner and policy factory of the current worker process, inherited from the parent when forking
+_worker_learner: Optional["AbstractModelLearner"] = None
+_worker_policy_factory: Optional[PolicyFactory] = None
+
+
+def _init_worker_(learner: "AbstractModelLearner", policy_factory: PolicyFactory):
+    global _worker_learner, _worker_policy_factory
+    _worker_learner = learner
+    _worker_policy_factory = policy_factory
+
+
+def _worker_episodes_(task: tuple) -> List[Episode]:
+    episodes, seed, model_version, model = task
+    # Workers outlive a call, they take the snapshot of the model sent with their task when it is newer than their own
+    if model_version != _worker_learner.model_version:
+        _worker_learner.model, _worker_learner.model_version = model, model_version
+    np.random.seed(seed)
+    policy = _worker_policy_factory(_worker_learner, seed)
+    return _worker_learner.env.do_episodes(policy, n=episodes)
 
 
 class AbstractModelLearner(ABC):
@@ -12,11 +45,16 @@ class AbstractModelLearner(ABC):
         self.env: AbstractEnvironment = env
         self.model = model
         self.replay_buffer: AbstractReplayBuffer = replay_buffer
-        self.metrics: dict[str, float] = {
-            "episode.reward": [],
-            "episode.length": [],
-            "training.loss": []
-        }
+        self.device: str = 'cpu'
+        # Incremented every time the weights of the model change
+        self.model_version: int = 0
+        # Keyword arguments of the last call to configure, saved by checkpoints
+        self.hyperparameters: dict = {}
+        self.instrumentation: Instrumentation = NULL_INSTRUMENTATION
+        self.metrics: MetricsStore = MetricsStore(["episode.reward", "episode.length", "training.loss"])
+        # Worker processes of produce_episodes_parallel, kept between calls along with their number and policy factory
+        self._pool = None
+        self._pool_key: Optional[tuple] = None
 
     def setup_training(self, loss_fn, optimizer, batch_size: int = 32, device: str = 'cpu', **kwargs):
         self.batch_size = batch_size
@@ -24,12 +62,69 @@ class AbstractModelLearner(ABC):
         self.optimizer = optimizer
         self.device = device
 
+    def setup_metrics(self, window: int = 10000, ema: float = .01, downsample: int = 1000, path: Optional[str] = None):
+        """
+        Replace the metrics of this learner with a new ```MetricsStore``` with the specified parameters.
+
+        Parameters
+        -----------
+        - **window**: the number of most recent values kept per metric
+        - **ema**: the smoothing factor of the exponential moving averages
+        - **downsample**: the number of values per block written to the history
+        - **path**: the append-only JSONL file of the downsampled history, None to disable it
+        """
+        self.metrics.flush()
+        self.metrics = MetricsStore(self.metrics.keys(), window, ema, downsample, path)
+
+    def set_instrumentation(self, instrumentation: Instrumentation):
+        """
+        Use the specified instrumentation to time the phases of this learner and of its environment.
+        Pass ```NULL_INSTRUMENTATION``` to disable it.
+        """
+        self.instrumentation = instrumentation
+        if hasattr(self.env, "instrumentation"):
+            self.env.instrumentation = instrumentation
+
     def configure(self, **kwargs):
         """
         Method to call to the configure the model learner.
         """
         pass
 
+    def state_dict(self, deferred: bool = False) -> dict:
+        """
+        Return the state of this learner: model, optimizer, hyperparameters, replay buffer and metrics.
+        Values are shared with the learner, see ```rfl.checkpoint``` to save them.
+
+        Parameters
+        -----------
+        - **deferred**: whether the state of the replay buffer may hold ```Deferred``` values, see ```deferred_state_dict```
+        """
+        buffer_state = self.replay_buffer.deferred_state_dict() if deferred else self.replay_buffer.state_dict()
+        state = {"model_version": self.model_version, "hyperparameters": dict(self.hyperparameters),
+                 "replay_buffer": buffer_state, "metrics": self.metrics.state_dict()}
+        if hasattr(self.model, "state_dict"):
+            state["model"] = self.model.state_dict()
+        if getattr(self, "optimizer", None) is not None:
+            state["optimizer"] = self.optimizer.state_dict()
+            state["batch_size"] = self.batch_size
+        return state
+
+    def load_state_dict(self, state: dict):
+        """
+        Restore the state of this learner from the specified dictionary produced by ```state_dict```.
+        The optimizer state is only restored if ```setup_training``` was called before.
+        """
+        self.configure(**state["hyperparameters"])
+        if "model" in state:
+            self.model.load_state_dict(state["model"])
+        if "optimizer" in state and getattr(self, "optimizer", None) is not None:
+            self.optimizer.load_state_dict(state["optimizer"])
+            self.batch_size = state["batch_size"]
+        self.replay_buffer.load_state_dict(state["replay_buffer"])
+        self.metrics.load_state_dict(state["metrics"])
+        self.model_version = state["model_version"]
+
     def produce_episodes(self, policy: Policy, episodes: int) -> None:
         """
         Produce the specified number of episodes, process them and add them to the data set.
@@ -39,10 +134,162 @@ class AbstractModelLearner(ABC):
         - **policy**: the policy to be used  to produce the episodes
         - **episodes**: the number of episodes to produce
         """
-        episodes: List[Episode] = self.env.do_episodes(policy, n=episodes)
+        with self.instrumentation.timer("episodes.generate"):
+            episodes: List[Episode] = self.env.do_episodes(policy, n=episodes)
+        self._ingest_episodes_(episodes)
+
+    def _ingest_episodes_(self, episodes: List[Episode]):
         for episode in episodes:
             self.produce_metrics(episode)
-        self.replay_buffer.store(episodes)
+        with self.instrumentation.timer("replay.store"):
+            self.replay_buffer.store(episodes)
+        self.instrumentation.count("episodes", len(episodes))
+        self.instrumentation.count("transitions", sum(len(episode) for episode in episodes))
+        self.instrumentation.tick()
+
+    def produce_episodes_parallel(self, policy_factory: PolicyFactory, episodes: int, processes: int, seed: int = 0) -> None:
+        """
+        Produce the specified number of episodes over a pool of worker processes, process them and add them to the data set.
+
+        Workers are forked from the current process, so each one holds its own copy of the environment and a read-only
+        snapshot of the model.
+        The pool is kept for the next calls with the same number of processes and policy factory, each task carries
+        the current **model_version** and model, which a worker loads when its own snapshot is older: pass the same
+        policy factory object to avoid forking at every call, and call ```close_pool``` once production is over.
+        The episodes are split into one task per worker, task i is run with ```numpy.random``` seeded with **seed** + i
+        and its policy built with the same seed, so that results only depend on **seed** and **processes**.
+        Requires the fork start method (not available on Windows).
+
+        Parameters
+        -----------
+        - **policy_factory**: a function that, given the learner copy of a worker and a seed, builds the policy to be used
+        - **episodes**: the number of episodes to produce
+        - **processes**: the number of worker processes
+        - **seed**: the base seed of the workers
+        """
+        tasks = [(episodes // processes + (i < episodes % processes), seed + i, self.model_version, self.model)
+                 for i in range(processes)]
+        with self.instrumentation.timer("episodes.generate"):
+            if self._pool is None or self._pool_key != (processes, policy_factory):
+                self.close_pool()
+                context = multiprocessing.get_context("fork")
+                self._pool = context.Pool(processes, initializer=_init_worker_, initargs=(self, policy_factory))
+                self._pool_key = (processes, policy_factory)
+            results: List[List[Episode]] = self._pool.map(_worker_episodes_, tasks, chunksize=1)
+        self._ingest_episodes_([episode for result in results for episode in result])
+
+    def close_pool(self):
+        """
+        Stop the worker processes of ```produce_episodes_parallel```, if any.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._pool_key = None
+
+    def _actor_copy_(self) -> "AbstractModelLearner":
+        """
+        Return a copy of this learner to be used by an actor thread: it has its own environment
+        and shares nothing that is not thread safe with this learner, except the second player of the environment,
+        which ```run_pipeline``` replaces when it is given an opponent factory.
+        """
+        actor = copy.copy(self)
+        actor.env = copy.deepcopy(self.env)
+        actor.set_instrumentation(self.instrumentation)
+        return actor
+
+    def _actor_loop_(self, actor: "AbstractModelLearner", policy: Policy, published: list, lock: threading.Lock,
+                     pending: queue.Queue, stop: threading.Event, errors: list):
+        try:
+            while not stop.is_set():
+                with lock:
+                    version, model = published
+                if version != actor.model_version:
+                    actor.model, actor.model_version = model, version
+                with actor.instrumentation.timer("episodes.generate"):
+                    episodes: List[Episode] = actor.env.do_episodes(policy, n=1)
+                while not stop.is_set():
+                    try:
+                        pending.put(episodes, timeout=.1)
+                        break
+                    except queue.Full:
+                        pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def run_pipeline(self, policy_factory: PolicyFactory, train_steps: int, actors: int = 2,
+                     replay_ratio: float = 1, publish_interval: int = 10, min_episodes: int = 1,
+                     max_pending: int = 64, seed: int = 0, opponent_factory: Optional[OpponentFactory] = None,
+                     **kwargs) -> None:
+        """
+        Produce episodes and train concurrently until the specified number of training steps is done.
+
+        Actor threads each hold a copy of the learner with their own environment and a snapshot of the model.
+        They produce episodes continuously into a bounded queue, which is drained into the replay buffer by this thread
+        between training steps. Every **publish_interval** training steps a copy of the model is published along with its
+        **model_version**, actors pick it up before their next episode.
+        The replay ratio bounds the number of training steps per episode ingested: training waits for episodes when it is
+        ahead, while actors block on the full queue when training is behind.
+
+        Parameters
+        -----------
+        - **policy_factory**: a function that, given the learner copy of an actor and a seed, builds the policy to be used
+        - **train_steps**: the number of training steps to do
+        - **actors**: the number of actor threads
+        - **replay_ratio**: the maximum number of training steps per episode ingested
+        - **publish_interval**: the number of training steps between two published models
+        - **min_episodes**: the number of episodes to ingest before training starts
+        - **max_pending**: the maximum number of episodes produced but not yet ingested
+        - **seed**: the base seed of the actors, actor i uses **seed** + i
+        - **opponent_factory**: a function that, given the seed of an actor, builds the second player of its environment.
+        If None, all the actors share the second player of the environment of this learner, which must then be stateless:
+        a policy such as ```solver_policy``` keeps a search state that actors would corrupt
+        - **kwargs**: passed to ```train```
+        """
+        lock = threading.Lock()
+        published = [self.model_version, copy.deepcopy(self.model)]
+        pending: queue.Queue = queue.Queue(max_pending)
+        stop = threading.Event()
+        errors: list = []
+        threads = []
+        for i in range(actors):
+            actor = self._actor_copy_()
+            actor.model, actor.model_version = published[1], published[0]
+            if opponent_factory is not None:
+                actor.env.attach_second_player(opponent_factory(seed + i))
+            policy = policy_factory(actor, seed + i)
+            threads.append(threading.Thread(target=self._actor_loop_, daemon=True,
+                                            args=(actor, policy, published, lock, pending, stop, errors)))
+        for thread in threads:
+            thread.start()
+
+        ingested, trained = 0, 0
+        try:
+            while trained < train_steps and not errors:
+                # Ingest at most one batch of episodes per training step, and wait for one only when training is ahead
+                waiting = ingested < min_episodes or trained >= replay_ratio * ingested
+                try:
+                    episodes = pending.get(timeout=.1) if waiting else pending.get_nowait()
+                    self._ingest_episodes_(episodes)
+                    ingested += len(episodes)
+                except queue.Empty:
+                    pass
+                if ingested < min_episodes or trained >= replay_ratio * ingested:
+                    continue
+                self.train(**kwargs)
+                trained += 1
+                if trained % publish_interval == 0:
+                    snapshot = copy.deepcopy(self.model)
+                    with lock:
+                        published[:] = [self.model_version, snapshot]
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
 
     @abstractmethod
     def train(self, **kwargs: dict):
@@ -1,8 +1,11 @@
 from rfl.env.abstract_environment import AbstractEnvironment, Action, State
 from rfl.learner.abstract_model_learner import AbstractModelLearner
+from rfl.inference_server import InferenceServer
+from rfl.policies import Policy
 
 
 from abc import ABC, abstractmethod
+from typing import List, Optional
 
 
 import numpy as np
@@ -11,13 +14,39 @@ import numpy as np
 class AbstractPolicyModelLearner(AbstractModelLearner, ABC):
 
     def action_probabilities_for(self, state: State) -> np.ndarray:
-        return self.model.predict(np.expand_dims(state, axis=0))
+        return self.action_probabilities_for_states(np.expand_dims(state, axis=0))[0]
+
+    def action_probabilities_for_states(self, states: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict(states))
+
+    def _legal_argmax_(self, env: AbstractEnvironment, probabilities: np.ndarray) -> Action:
+        legal_actions: List[Action] = env.get_possible_actions()
+        indices = [env.action_space.index(action) for action in legal_actions]
+        return legal_actions[int(np.argmax(probabilities[indices]))]
 
     @property
     def greedy_model_policy(self) -> Policy:
         def policy(env: AbstractEnvironment) -> Action:
             s = env.get_state_copy()
-            legal_actions = env.get_possible_actions()
-            chosen = np.argmax(self.action_probabilities_for(s)))
-            return chosen
+            return self._legal_argmax_(env, self.action_probabilities_for(s))
+        return policy
+
+    def inference_server(self, max_batch_size: int = 256, max_wait: float = .001) -> InferenceServer:
+        """
+        Create an inference server evaluating the action probabilities of batches of states with the model of this learner.
+        It must be started before use.
+        """
+        server = InferenceServer(self.action_probabilities_for_states, max_batch_size, max_wait)
+        server.instrumentation = self.instrumentation
+        return server
+
+    def served_greedy_policy(self, server: InferenceServer) -> Policy:
+        """
+        Create the greedy policy following this model whose states are evaluated by the specified server,
+        so that the moves of concurrent games are evaluated in batches.
+        It can be used both as a policy and as a second player with ```attach_second_player```.
+        """
+        def policy(env: AbstractEnvironment, player: Optional[int] = None) -> Action:
+            probabilities = server.evaluate(np.expand_dims(env.get_state_copy(), axis=0))[0]
+            return self._legal_argmax_(env, probabilities)
         return policy
@@ -1,9 +1,15 @@
 from rfl.env.abstract_environment import AbstractEnvironment, Action, State
-from rfl.learner.abstract_model_learner import AbstractModelLearner
-from rfl.policies import Policy
+from rfl.learner.abstract_model_learner import AbstractModelLearner, PolicyFactory
+from rfl.abstract_replay_buffer import AbstractReplayBuffer
+from rfl.datastructure.lru_cache import LRUCache
+from rfl.inference_server import InferenceServer
+from rfl.numpy_model import NumpyModel, export_numpy_model
+from rfl.policies import Policy, BatchPolicy, batch_greedy_action_values
 
 from abc import ABC
-from typing import List
+from typing import List, Optional
+
+import copy
 
 import torch
 import numpy as np
@@ -11,18 +17,166 @@ import numpy as np
 
 class AbstractStateModelLearner(AbstractModelLearner, ABC):
 
+    def __init__(self, env: AbstractEnvironment, model, replay_buffer: AbstractReplayBuffer):
+        super(AbstractStateModelLearner, self).__init__(env, model, replay_buffer)
+        self.value_cache: Optional[LRUCache] = None
+        self._value_cache_version: int = 0
+        self.inference_backend: Optional[str] = None
+        self._inference_model: Optional[torch.nn.Module] = None
+        self._inference_source = None
+        self._inference_version: int = -1
+
+    def enable_value_cache(self, capacity: int = 100000):
+        """
+        Cache the values of the states evaluated by ```value_of_state```, ```value_of_states```, ```value_of_state_action```
+        and ```value_of_state_actions```.
+        States are keyed by ```env.get_state_keys```, the cache is cleared whenever **model_version** changes.
+
+        Parameters
+        -----------
+        - **capacity**: the maximum number of states in the cache, the least recently used ones are evicted first
+        """
+        self.value_cache = LRUCache(capacity)
+        self._value_cache_version = self.model_version
+
+    def disable_value_cache(self):
+        self.value_cache = None
+
+    def enable_inference_mode(self, backend: str = "eager"):
+        """
+        Evaluate states under ```torch.inference_mode``` and select greedy moves through preallocated buffers:
+        the successors of the current state for every action of the action space are written in place by
+        ```env.write_states_with_actions``` and evaluated in one forward pass, so that ```greedy_model_policy``` allocates
+        no array per move. Greedy moves bypass the value cache.
+
+        Parameters
+        -----------
+        - **backend**: the model used for inference, "eager" for the model itself, "torchscript" for a traced and frozen
+        copy of the model in eval mode used by greedy moves only, see ```publish_inference_model```, "compile" for the model
+        compiled with ```torch.compile```
+        """
+        if backend not in ("eager", "torchscript", "compile"):
+            raise ValueError("unknown inference backend: {}".format(backend))
+        self.inference_backend = backend
+        self._inference_model = None
+        actions = len(self.env.action_space)
+        shape = (actions,) + self.env.get_state_copy().shape
+        self._inference_input: torch.Tensor = torch.zeros(shape, dtype=torch.float32)
+        # Shares the memory of the input tensor
+        self._inference_states: np.ndarray = self._inference_input.numpy()
+        self._inference_device_input: torch.Tensor = self._inference_input if self.device == 'cpu' \
+            else torch.zeros(shape, dtype=torch.float32, device=self.device)
+        self._inference_mask: np.ndarray = np.zeros(actions, dtype=bool)
+        self._inference_scores: np.ndarray = np.zeros(actions, dtype=np.float32)
+
+    def disable_inference_mode(self):
+        self.inference_backend = None
+        self._inference_model = None
+
+    def publish_inference_model(self):
+        """
+        Make greedy moves use the current weights of the model: the "torchscript" backend traces the model again before
+        the next move. Training steps do not, ```produce_episodes``` and ```produce_episodes_parallel``` publish the model when it
+        changed since the last time, and actors of ```run_pipeline``` when they receive a new snapshot.
+        """
+        self._inference_model = None
+
+    def _inference_model_(self) -> torch.nn.Module:
+        if self.inference_backend == "eager":
+            return self.model
+        if self._inference_model is None or self._inference_source is not self.model:
+            if self.inference_backend == "torchscript":
+                with torch.no_grad():
+                    traced = torch.jit.trace(copy.deepcopy(self.model).eval(), self._inference_device_input)
+                self._inference_model = torch.jit.freeze(traced)
+            else:
+                # The compiled model shares the parameters of the model
+                self._inference_model = torch.compile(self.model)
+            self._inference_source = self.model
+            self._inference_version = self.model_version
+        return self._inference_model
+
+    def __forward(self, x: torch.Tensor) -> torch.Tensor:
+        if self.inference_backend is None:
+            return self.model(x)
+        with torch.inference_mode():
+            # Evaluations for training use the weights of the model as they are, the traced copy only plays greedy moves
+            model = self.model if self.inference_backend == "torchscript" else self._inference_model_()
+            return model(x)
+
+    def __greedy_inference_action(self, env: AbstractEnvironment) -> Action:
+        mask, scores = self._inference_mask, self._inference_scores
+        env.write_states_with_actions(self._inference_states, mask)
+        inputs = self._inference_device_input
+        if inputs is not self._inference_input:
+            inputs.copy_(self._inference_input)
+        with torch.inference_mode():
+            values = self._inference_model_()(inputs)
+        scores.fill(-np.inf)
+        np.copyto(scores, values.reshape(-1).cpu().numpy(), where=mask)
+        return env.action_space[int(np.argmax(scores))]
+
+    def _actor_copy_(self) -> AbstractModelLearner:
+        actor = super(AbstractStateModelLearner, self)._actor_copy_()
+        if self.value_cache is not None:
+            actor.value_cache = LRUCache(self.value_cache.capacity)
+        if self.inference_backend is not None:
+            # Buffers are not shared between actors
+            actor.enable_inference_mode(self.inference_backend)
+        return actor
+
+    def __publish_changed_inference_model(self):
+        if self.inference_backend == "torchscript" and self._inference_version != self.model_version:
+            self.publish_inference_model()
+
+    def produce_episodes(self, policy: Policy, episodes: int) -> None:
+        self.__publish_changed_inference_model()
+        super(AbstractStateModelLearner, self).produce_episodes(policy, episodes)
+
+    def produce_episodes_parallel(self, policy_factory: PolicyFactory, episodes: int, processes: int, seed: int = 0) -> None:
+        self.__publish_changed_inference_model()
+        super(AbstractStateModelLearner, self).produce_episodes_parallel(policy_factory, episodes, processes, seed)
+
+    def load_state_dict(self, state: dict):
+        super(AbstractStateModelLearner, self).load_state_dict(state)
+        if self.value_cache is not None:
+            self.value_cache.clear()
+        self.publish_inference_model()
+
+    def numpy_model(self) -> NumpyModel:
+        """
+        Return a copy of the current model of this learner that runs with NumPy alone, see ```NumpyModel```.
+        """
+        return export_numpy_model(self.model)
+
     def value_of_state(self, state: State) -> float:
-        return self.model(torch.FloatTensor(np.expand_dims(state, axis=0)).to(self.device))
+        return self.value_of_states(np.expand_dims(state, axis=0))
 
     def value_of_states(self, states: List[State]) -> np.ndarray:
-        if len(states) > 0:
-            return self.model(torch.FloatTensor(np.asarray(states, dtype=np.float32)).to(self.device))
-        else:
+        if len(states) == 0:
             return []
+        if self.value_cache is None:
+            return self.__forward(torch.FloatTensor(np.asarray(states, dtype=np.float32)).to(self.device))
+        return self.__cached_value_of_states(np.asarray(states))
+
+    def __cached_value_of_states(self, states: np.ndarray) -> torch.Tensor:
+        cache = self.value_cache
+        if self._value_cache_version != self.model_version:
+            cache.clear()
+            self._value_cache_version = self.model_version
+        keys = self.env.get_state_keys(states)
+        values = [cache.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            with torch.no_grad():
+                computed = self.__forward(torch.FloatTensor(states[missing].astype(np.float32)).to(self.device)).cpu().numpy()
+            for i, value in zip(missing, computed):
+                cache.put(keys[i], value)
+                values[i] = value
+        return torch.from_numpy(np.stack(values)).to(self.device)
 
     def value_of_state_action(self, state: State, action: Action) -> float:
-        state = self.env.get_state_with_action(state.copy(), action)
-        return self.model(torch.FloatTensor(np.expand_dims(state, axis=0)).to(self.device))
+        return self.value_of_state(self.env.get_state_with_action(state.copy(), action))
 
     def value_of_state_actions(self, state: State, actions: List[Action]) -> np.ndarray:
         return self.value_of_states([self.env.get_state_with_action(state.copy(), action) for action in actions])
@@ -30,7 +184,53 @@ class AbstractStateModelLearner(AbstractModelLearner, ABC):
     @property
     def greedy_model_policy(self) -> Policy:
         def policy(env: AbstractEnvironment) -> Action:
+            if self.inference_backend is not None:
+                return self.__greedy_inference_action(env)
+            s = env.get_state_copy()
+            legal_actions = env.get_possible_actions()
+            # Successors are computed by the environment of the game, whose turn may differ from the one of the learner
+            values = self.value_of_states([env.get_state_with_action(s.copy(), action) for action in legal_actions])
+            return legal_actions[np.argmax(values.detach().numpy())]
+        return policy
+
+    @property
+    def greedy_model_batch_policy(self) -> BatchPolicy:
+        """
+        Return the batched greedy policy following this model: the successors of all the states of a batch are evaluated
+        in one forward pass.
+        """
+        def action_values(states: np.ndarray) -> np.ndarray:
+            successors, _ = self.env.get_states_with_actions(states)
+            values = self.__evaluate_values(successors.reshape((-1,) + successors.shape[2:]))
+            return values.reshape(successors.shape[:2])
+        return batch_greedy_action_values(action_values)
+
+    def __evaluate_values(self, states: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return self.value_of_states(states).cpu().numpy().reshape(-1)
+
+    def inference_server(self, max_batch_size: int = 256, max_wait: float = .001) -> InferenceServer:
+        """
+        Create an inference server evaluating the values of batches of states with the model of this learner,
+        through the value cache if it is enabled.
+        It must be started before use.
+        """
+        server = InferenceServer(self.__evaluate_values, max_batch_size, max_wait)
+        server.instrumentation = self.instrumentation
+        return server
+
+    def served_greedy_policy(self, server: InferenceServer) -> Policy:
+        """
+        Create the greedy policy following this model whose states are evaluated by the specified server,
+        so that the moves of concurrent games are evaluated in batches.
+        It can be used both as a policy and as a second player with ```attach_second_player```: states are valued from
+        the point of view of the player of the environment of this learner, so another player picks the lowest value.
+        """
+        def policy(env: AbstractEnvironment, player: Optional[int] = None) -> Action:
             s = env.get_state_copy()
             legal_actions = env.get_possible_actions()
-            return legal_actions[np.argmax(self.value_of_state_actions(s, legal_actions).detach().numpy())]
+            values = server.evaluate(np.asarray([env.get_state_with_action(s.copy(), action) for action in legal_actions]))
+            if player is not None and player != self.env.player:
+                values = -values
+            return legal_actions[np.argmax(values)]
         return policy
@@ -1,10 +1,11 @@
 from rfl.learner.abstract_state_model_learner import AbstractStateModelLearner
 from rfl.abstract_replay_buffer import SARSTuple
+from rfl.ring_replay_buffer import SARSBatch
 
 
 import torch
 
-from typing import List, Tuple, Optional
+from typing import List
 
 import numpy as np
 
@@ -13,46 +14,93 @@ class SemiGradientSARSALearner(AbstractStateModelLearner):
     def configure(self,  gamma: float = 1, steps: int = 1, **kwargs):
         self.gamma = gamma
         self.steps = steps
+        self.hyperparameters = dict(kwargs, gamma=gamma, steps=steps)
 
     def train(self, **kwargs):
-        transitions: List[SARSTuple] = self.replay_buffer.sample(self.batch_size, self.steps)
-        X, Y, W = [], [], []
-        for trans in transitions:
-            x, y, w = self._transition_to_dataset_(trans)
-            X.append(x)
-            Y.append(y)
-            if w:
-                W.append(w)
+        instrumentation = self.instrumentation
+        # Buffers that sample arrays directly skip building the transitions
+        batched = hasattr(self.replay_buffer, "sample_batch")
+        with instrumentation.timer("replay.sample"):
+            if batched:
+                batch: SARSBatch = self.replay_buffer.sample_batch(self.batch_size, self.steps)
+            else:
+                transitions: List[SARSTuple] = self.replay_buffer.sample(self.batch_size, self.steps)
+        with instrumentation.timer("train.targets"):
+            if batched:
+                X = np.asarray(batch[0], dtype=np.float32)
+                Y = self._batch_targets_(batch).astype(np.float32)
+                W = []
+            else:
+                X = np.asarray([state for (state, _, _, _, _) in transitions], dtype=np.float32)
+                Y = self._targets_(transitions).astype(np.float32)
+                W = [w for (_, _, _, _, w) in transitions if w is not None]
 
         # Dataset is now ready
-        X = np.asarray(X, dtype=np.float32)
-        Y = np.asarray(Y, dtype=np.float32)
         X = torch.FloatTensor(X).to(self.device)
         y_true = torch.FloatTensor(Y).to(self.device)
         weights = None
         if W:
             weights = torch.FloatTensor(np.asarray(W, dtype=np.float32)).to(self.device)
         # Actual learning
-        self.model.zero_grad()
-        y_pred = self.model(X)
-        if W:
-            loss = self.loss_fn(y_pred.flatten(), y_true, reduction='none')
-            ef_loss = torch.mean(loss * weights)
-        else:
-            loss = self.loss_fn(y_pred.flatten(), y_true)
-            ef_loss = loss
-        self.optimizer.zero_grad()
-        ef_loss.backward()
-        self.optimizer.step()
-        nloss = loss.detach().numpy()
+        with instrumentation.timer("train.forward_backward"):
+            self.model.zero_grad()
+            y_pred = self.model(X)
+            if W:
+                loss = self.loss_fn(y_pred.flatten(), y_true, reduction='none')
+                ef_loss = torch.mean(loss * weights)
+            else:
+                loss = self.loss_fn(y_pred.flatten(), y_true)
+                ef_loss = loss
+            self.optimizer.zero_grad()
+            ef_loss.backward()
+        with instrumentation.timer("train.optimizer_step"):
+            self.optimizer.step()
+        self.model_version += 1
+        nloss = loss.detach().cpu().numpy()
         self.metrics["training.loss"].append(np.mean(nloss))
+        instrumentation.count("train.steps")
+        instrumentation.tick()
         return nloss
 
-    def _transition_to_dataset_(self, transition: SARSTuple) -> Tuple[np.ndarray, float, Optional[float]]:
-        (state, action, reward, afterwards, w) = transition
-        T: int = len(afterwards)
-        G = reward + np.sum([self.gamma**(i + 1) * r for i, (s, a, r) in enumerate(afterwards[:-1])])
-        if T == self.steps:
-            last_state = afterwards[-1][0].copy()
-            G += self.gamma**self.steps * self.value_of_state(last_state).detach().numpy()
-        return state, G, w
+    def _targets_(self, transitions: List[SARSTuple]) -> np.ndarray:
+        """
+        Compute the n-step return of each transition.
+        Transitions followed by **steps** transitions are bootstrapped from the value of the last state,
+        all of them being evaluated at once by ```_bootstrap_values_```.
+        """
+        rewards = np.zeros((len(transitions), self.steps + 1), dtype=np.float64)
+        bootstrapped: List[int] = []
+        last_states = []
+        for i, (_, _, reward, afterwards, _) in enumerate(transitions):
+            rewards[i, 0] = reward
+            T: int = len(afterwards)
+            if T == self.steps:
+                # The reward of the last transition is part of the bootstrapped value
+                bootstrapped.append(i)
+                last_states.append(afterwards[-1][0])
+                afterwards = afterwards[:-1]
+            rewards[i, 1:len(afterwards) + 1] = [r for (_, _, r) in afterwards]
+        G = rewards @ np.power(self.gamma, np.arange(self.steps + 1), dtype=np.float64)
+        if bootstrapped:
+            G[bootstrapped] += self.gamma**self.steps * self._bootstrap_values_(np.asarray(last_states))
+        return G
+
+    def _batch_targets_(self, batch: SARSBatch) -> np.ndarray:
+        """
+        Compute the n-step return of each transition of a batch sampled by ```sample_batch```, like ```_targets_```.
+        """
+        _, _, rewards, next_states, _, next_rewards, lengths = batch
+        bootstrapped = lengths == self.steps
+        # The reward of the last transition of a full window is part of the bootstrapped value
+        counted = np.arange(self.steps) < (lengths - bootstrapped)[:, np.newaxis]
+        G = rewards + np.where(counted, next_rewards, 0) @ np.power(self.gamma, np.arange(1, self.steps + 1), dtype=np.float64)
+        if np.any(bootstrapped):
+            G[bootstrapped] += self.gamma**self.steps * self._bootstrap_values_(next_states[bootstrapped, self.steps - 1])
+        return G
+
+    def _bootstrap_values_(self, states: np.ndarray) -> np.ndarray:
+        """
+        Compute the values of the specified states used to bootstrap the returns, in one forward pass.
+        """
+        with torch.no_grad():
+            return self.value_of_states(states).cpu().numpy().reshape(-1)
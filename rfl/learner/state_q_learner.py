@@ -1,28 +1,16 @@
 from rfl.learner.semi_gradient_sarsa import SemiGradientSARSALearner
-from rfl.abstract_replay_buffer import SARSTuple
-from rfl.env.abstract_environment import State
 
-from typing import Tuple, Optional
+import torch
 
 import numpy as np
 
 
 class StateQLearner(SemiGradientSARSALearner):
 
-    def __best_value(self, state: State):
-        self.env.push()
-        self.env.set_state(state)
-        self.env.winner = -1
-        values = self.value_of_state_actions(state, self.env.get_possible_actions()).detach().numpy()
-        self.env.pop()
-        return np.max(values)
-
-    def _transition_to_dataset_(self, transition: SARSTuple) -> Tuple[np.ndarray, float, Optional[float]]:
-        (state, action, reward, afterwards, w) = transition
-        T: int = len(afterwards)
-        G = reward + np.sum([self.gamma**(i + 1) * r for i, (s, a, r) in enumerate(afterwards[:-1])])
-        if T == self.steps:
-            last_state = afterwards[-1][0].copy()
-            value = self.__best_value(last_state)
-            G += self.gamma**self.steps * value
-        return state, G, w
+    def _bootstrap_values_(self, states: np.ndarray) -> np.ndarray:
+        # Every successor of every state goes through one forward pass, illegal actions are masked out of the max
+        successors, mask = self.env.get_states_with_actions(states)
+        with torch.no_grad():
+            values = self.value_of_states(successors.reshape((-1,) + states.shape[1:])).cpu().numpy()
+        values = np.where(mask, values.reshape(mask.shape), -np.inf)
+        return np.where(np.any(mask, axis=1), np.max(values, axis=1), 0)
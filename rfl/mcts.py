@@ -0,0 +1,197 @@
+from rfl.env.abstract_environment import Action, State
+from rfl.env.abstract_2player_environment import Abstract2PlayerEnvironment
+from rfl.learner.abstract_state_model_learner import AbstractStateModelLearner
+
+from typing import List, Optional, Tuple
+
+import torch
+import numpy as np
+
+
+class MCTS():
+    """
+    Monte Carlo Tree Search using the value model of a learner to evaluate leaves.
+
+    Simulations are run by batches: each simulation of a batch descends the tree with a virtual loss on the nodes it went
+    through so that the next ones explore other paths, then all the leaves of the batch are evaluated in one forward pass.
+    The tree is stored in arrays indexed by node, and the subtree of the position reached after the move of the opponent
+    is reused by the next search.
+
+    Values of nodes are kept from the point of view of the player who made the move leading to the node.
+    The model is assumed to value states from the point of view of **player**.
+
+    Parameters
+    -----------
+    - **learner**: the learner whose model evaluates leaves
+    - **simulations**: the number of simulations per move
+    - **batch_size**: the number of leaves evaluated per forward pass
+    - **exploration**: the exploration constant of UCT
+    - **virtual_loss**: the loss added to nodes being evaluated
+    - **capacity**: the maximum number of nodes, the tree is cleared when it is full,
+    it must be at least len(action_space) * **simulations** + 1
+    - **player**: the player from whose point of view the model values states, the player of the learner environment by default
+    """
+
+    def __init__(self, learner: AbstractStateModelLearner, simulations: int = 256, batch_size: int = 32,
+                 exploration: float = 1.4, virtual_loss: float = 1, capacity: int = 100000, player: Optional[int] = None):
+        self.learner: AbstractStateModelLearner = learner
+        self.simulations: int = simulations
+        self.batch_size: int = batch_size
+        self.exploration: float = exploration
+        self.virtual_loss: float = virtual_loss
+        self.player: int = learner.env.player if player is None else player
+        self.capacity: int = capacity
+        self.action_space: Tuple[Action] = learner.env.action_space
+        # A search from an empty tree expands at most one node per simulation
+        if capacity < len(self.action_space) * simulations + 1:
+            raise ValueError("a capacity of {} nodes is too small for {} simulations with {} actions, at least {} are needed"
+                             .format(capacity, simulations, len(self.action_space), len(self.action_space) * simulations + 1))
+
+        self.visits: np.ndarray = np.zeros(capacity, dtype=np.int64)
+        self.value_sums: np.ndarray = np.zeros(capacity, dtype=np.float64)
+        self.movers: np.ndarray = np.zeros(capacity, dtype=np.int64)
+        self.expanded: np.ndarray = np.zeros(capacity, dtype=bool)
+        self.terminal: np.ndarray = np.zeros(capacity, dtype=bool)
+        self.terminal_values: np.ndarray = np.zeros(capacity, dtype=np.float64)
+        self.children: np.ndarray = np.full((capacity, len(self.action_space)), -1, dtype=np.int64)
+        self.size: int = 0
+        self.root: int = -1
+        # State of the root once the move was chosen, used to find the new root after the move of the opponent
+        self._root_state: Optional[State] = None
+
+    def clear(self):
+        self.visits[:self.size] = 0
+        self.value_sums[:self.size] = 0
+        self.expanded[:self.size] = False
+        self.terminal[:self.size] = False
+        self.children[:self.size] = -1
+        self.size = 0
+        self.root = -1
+        self._root_state = None
+
+    def _new_node_(self, mover: int) -> int:
+        node = self.size
+        self.size += 1
+        self.movers[node] = mover
+        return node
+
+    def _terminal_value_(self, env: Abstract2PlayerEnvironment, mover: int) -> float:
+        if env.winner == mover:
+            return env.win_reward
+        elif abs(env.winner - mover) == 1:
+            return -env.win_reward
+        return env.draw_reward
+
+    def _find_root_(self, env: Abstract2PlayerEnvironment):
+        state = env.get_state_copy()
+        if self.root >= 0 and self._root_state is not None:
+            if np.array_equal(state, self._root_state):
+                return
+            # Look for the move of the opponent among the children of the root
+            env.push()
+            env.set_state(self._root_state.copy())
+            found = -1
+            for j, child in enumerate(self.children[self.root]):
+                if child >= 0:
+                    env.make_move(self.action_space[j])
+                    same = np.array_equal(env.get_state_copy(), state)
+                    env.unmake_move()
+                    if same:
+                        found = child
+                        break
+            env.pop()
+            if found >= 0 and self.size + len(self.action_space) * self.simulations < self.capacity:
+                self.root = found
+                return
+        self.clear()
+        self.root = self._new_node_(1 - env.turn)
+
+    def _select_(self, node: int) -> int:
+        children = self.children[node]
+        j = np.flatnonzero(children >= 0)
+        nodes = children[j]
+        visits = self.visits[nodes]
+        unvisited = visits == 0
+        if np.any(unvisited):
+            return j[np.argmax(unvisited)]
+        scores = self.value_sums[nodes] / visits + self.exploration * np.sqrt(np.log(self.visits[node]) / visits)
+        return j[np.argmax(scores)]
+
+    def _descend_(self, env: Abstract2PlayerEnvironment) -> Tuple[List[int], Optional[State]]:
+        """
+        Descend from the root to a leaf, expand it and return the path and the state of the leaf to be evaluated,
+        None if the leaf is terminal.
+        """
+        node = self.root
+        path = [node]
+        self.visits[node] += 1
+        while self.expanded[node] and not self.terminal[node]:
+            j = self._select_(node)
+            env.make_move(self.action_space[j])
+            node = self.children[node, j]
+            path.append(node)
+            # Virtual loss
+            self.visits[node] += 1
+            self.value_sums[node] -= self.virtual_loss
+
+        state = None
+        if not self.expanded[node]:
+            self.expanded[node] = True
+            if env.is_closed():
+                self.terminal[node] = True
+                self.terminal_values[node] = self._terminal_value_(env, self.movers[node])
+            else:
+                for action in env.get_possible_actions():
+                    self.children[node, self.action_space.index(action)] = self._new_node_(env.turn)
+                state = env.get_state_copy()
+        for _ in range(len(path) - 1):
+            env.unmake_move()
+        return path, state
+
+    def _backup_(self, path: List[int], value: float):
+        leaf_mover = self.movers[path[-1]]
+        for node in path[1:]:
+            self.value_sums[node] += self.virtual_loss + (value if self.movers[node] == leaf_mover else -value)
+
+    def search(self, env: Abstract2PlayerEnvironment) -> np.ndarray:
+        """
+        Run the simulations from the current state of the specified environment, the environment is left unchanged.
+
+        Return
+        -----------
+        The number of visits of each action at the root.
+        """
+        self._find_root_(env)
+        done = 0
+        while done < self.simulations:
+            paths, pending, states = [], [], []
+            for _ in range(min(self.batch_size, self.simulations - done)):
+                path, state = self._descend_(env)
+                if state is None:
+                    self._backup_(path, self.terminal_values[path[-1]])
+                else:
+                    pending.append(path)
+                    states.append(state)
+                done += 1
+            if states:
+                with torch.no_grad():
+                    values = self.learner.value_of_states(np.asarray(states)).cpu().numpy().reshape(-1)
+                for path, value in zip(pending, values.tolist()):
+                    mover = self.movers[path[-1]]
+                    self._backup_(path, value if mover == self.player else -value)
+        children = self.children[self.root]
+        return np.where(children >= 0, self.visits[np.maximum(children, 0)], 0)
+
+    def __call__(self, env: Abstract2PlayerEnvironment, player: Optional[int] = None) -> Action:
+        """
+        Choose the most visited action at the root for the player whose turn it is.
+        It can be used both as a policy and as a second player with ```attach_second_player```.
+        """
+        visits = self.search(env)
+        j = int(np.argmax(visits))
+        action = self.action_space[j]
+        self.root = self.children[self.root, j]
+        env.make_move(action)
+        self._root_state = env.get_state_copy()
+        env.unmake_move()
+        return action
@@ -0,0 +1,130 @@
+from rfl.env.abstract_environment import Episode
+from rfl.ring_replay_buffer import RingReplayBuffer
+from rfl.state_codec import StateCodec
+
+from typing import List, Tuple, Optional
+
+import json
+import os
+
+import numpy as np
+
+
+class MemmapReplayBuffer(RingReplayBuffer):
+    """
+    Uniform ring replay buffer whose arrays are ```.npy``` files of the specified directory mapped in memory,
+    so that it can be far larger than RAM.
+
+    The files are flushed and the position of the head, the number of transitions and the total number of transitions
+    written are saved in ```meta.json``` after every ```store```, opening a directory that already contains a buffer maps
+    its files again without reading them.
+    Files of the directory whose shape or dtype differ from the ones of the buffer are not overwritten, it raises instead.
+    Transitions are written sequentially so the pages of recent data stay in the page cache, sampled indices are sorted
+    so that a batch is gathered in one pass over the files.
+    Using a codec keeps the states file small, e.g. 16 bytes per state with ```ConnectStateCodec```.
+
+    Parameters
+    -----------
+    - **directory**: the directory of the files, created if it does not exist
+    - **size**: the maximum number of transitions, ignored when reopening an existing buffer
+    - **seed**: the seed of the sampling generator
+    - **codec**: the codec used to store states, reopening a buffer with another codec raises
+    """
+
+    META_FILE: str = "meta.json"
+
+    def __init__(self, directory: str, size: int = 1000000, seed: int = 0, codec: Optional[StateCodec] = None):
+        self.directory: str = directory
+        os.makedirs(directory, exist_ok=True)
+        meta = self._load_meta_()
+        if meta is not None:
+            size = meta["size"]
+            if meta.get("codec") != self._codec_name_(codec):
+                raise ValueError("{} holds a buffer stored with codec {}, not {}".format(
+                    directory, meta.get("codec"), self._codec_name_(codec)))
+        super(MemmapReplayBuffer, self).__init__(size, seed, codec)
+        # Total number of transitions written, a checkpoint only matches the files if none were written after it
+        self._written: int = 0
+        if meta is not None:
+            self._head = meta["head"]
+            self._count = meta["count"]
+            self._written = meta["written"]
+            if os.path.exists(self._path_("states")):
+                self._states = np.load(self._path_("states"), mmap_mode="r+")
+
+    @staticmethod
+    def _codec_name_(codec: Optional[StateCodec]) -> Optional[str]:
+        return type(codec).__name__ if codec is not None else None
+
+    def _path_(self, name: str) -> str:
+        return os.path.join(self.directory, name + ".npy")
+
+    def _load_meta_(self) -> Optional[dict]:
+        path = os.path.join(self.directory, self.META_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as fd:
+            return json.load(fd)
+
+    def _save_meta_(self):
+        path = os.path.join(self.directory, self.META_FILE)
+        with open(path + ".tmp", "w") as fd:
+            json.dump({"size": self._size, "head": self._head, "count": self._count, "written": self._written,
+                       "codec": self._codec_name_(self.codec)}, fd)
+        os.replace(path + ".tmp", path)
+
+    def _allocate_(self, name: str, shape: Tuple[int, ...], dtype) -> np.ndarray:
+        path = self._path_(name)
+        if os.path.exists(path):
+            array = np.load(path, mmap_mode="r+")
+            if array.shape != shape or array.dtype != dtype:
+                raise ValueError("{} holds an array of shape {} and dtype {}, expected shape {} and dtype {}".format(
+                    path, array.shape, array.dtype, shape, np.dtype(dtype)))
+            return array
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+    def _sample_indices_(self, size: int) -> np.ndarray:
+        return np.sort(super(MemmapReplayBuffer, self)._sample_indices_(size))
+
+    def store(self, episodes: List[Episode]):
+        super(MemmapReplayBuffer, self).store(episodes)
+        self._written += sum(len(episode) for episode in episodes)
+        # The transitions must be on disk before the metadata pointing at them
+        self.flush()
+
+    def state_dict(self) -> dict:
+        """
+        Flush the files and return the position of the head, the number of transitions and the number of transitions
+        written, the files themselves are not part of the state: the buffer must be restored from the same directory.
+        """
+        self.flush()
+        return {"directory": os.path.abspath(self.directory), "size": self._size, "head": self._head, "count": self._count,
+                "written": self._written, "generator": self.generator.bit_generator.state}
+
+    def load_state_dict(self, state: dict):
+        """
+        Restore the buffer as it was when the state was saved. Transitions written to the files since then are dropped,
+        it raises if they overwrote transitions of the saved buffer.
+        """
+        if state["size"] != self._size:
+            raise ValueError("cannot load a buffer of size {} into a buffer of size {}".format(state["size"], self._size))
+        newer = self._written - state["written"]
+        if newer < 0:
+            raise ValueError("the files of {} are older than the checkpoint of the buffer".format(self.directory))
+        if newer > self._size - state["count"]:
+            raise ValueError("{} transitions were written to {} since the checkpoint of the buffer, overwriting some of its {}"
+                             .format(newer, self.directory, state["count"]))
+        self._head = state["head"]
+        self._count = state["count"]
+        self._written = state["written"]
+        self.generator.bit_generator.state = state["generator"]
+        self._save_meta_()
+
+    def flush(self):
+        """
+        Write the modified pages of all files to disk.
+        """
+        for array in (self._states, self._actions, self._rewards, self._remaining):
+            if isinstance(array, np.memmap):
+                array.flush()
+        self._save_meta_()
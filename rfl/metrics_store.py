@@ -0,0 +1,115 @@
+from rfl.datastructure.streaming_metric import StreamingMetric
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import json
+
+import numpy as np
+
+
+class MetricsStore():
+    """
+    Bounded store of the metrics of a learner, mapping names to ```StreamingMetric```.
+
+    Metrics are read like the dictionary of lists it replaces, ```store["episode.reward"].append(r)``` and
+    ```plt.plot(store["episode.reward"])``` still work, a metric is created the first time its name is used.
+    If a path is given, the mean, min and max of every block of **downsample** values of each metric are appended
+    to it as JSON lines, so that the whole history of a run can be plotted with ```load_history```.
+    Lines are buffered and written every **flush_blocks** blocks and on ```flush```.
+
+    Parameters
+    -----------
+    - **names**: the names of the metrics created upfront
+    - **window**: the number of most recent values kept per metric
+    - **ema**: the smoothing factor of the exponential moving averages
+    - **downsample**: the number of values per block written to the history
+    - **path**: the append-only JSONL file of the downsampled history, None to disable it
+    - **flush_blocks**: the number of buffered blocks that triggers a write
+    """
+
+    def __init__(self, names: Iterable[str] = (), window: int = 10000, ema: float = .01, downsample: int = 1000,
+                 path: Optional[str] = None, flush_blocks: int = 16):
+        self.window: int = window
+        self.ema: float = ema
+        self.downsample: int = downsample
+        self.path: Optional[str] = path
+        self.flush_blocks: int = flush_blocks
+        self._metrics: Dict[str, StreamingMetric] = {}
+        self._pending: List[str] = []
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str) -> StreamingMetric:
+        metric = StreamingMetric(name, self.window, self.ema, self.downsample, self._on_block_ if self.path else None)
+        self._metrics[name] = metric
+        return metric
+
+    def _on_block_(self, metric: StreamingMetric, stats: Dict[str, float]):
+        stats["metric"] = metric.name
+        self._pending.append(json.dumps(stats))
+        if len(self._pending) >= self.flush_blocks:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered blocks to the history file.
+        """
+        if not self._pending or not self.path:
+            return
+        with open(self.path, "a") as fd:
+            fd.write("\n".join(self._pending) + "\n")
+        self._pending.clear()
+
+    def state_dict(self) -> dict:
+        return {"metrics": {name: metric.state_dict() for name, metric in self._metrics.items()}, "pending": list(self._pending)}
+
+    def load_state_dict(self, state: dict):
+        for name, metric_state in state["metrics"].items():
+            self[name].load_state_dict(metric_state)
+        self._pending = list(state["pending"]) if self.path else []
+
+    def summary(self) -> Dict[str, dict]:
+        return {name: metric.summary() for name, metric in self._metrics.items()}
+
+    def __getitem__(self, name: str) -> StreamingMetric:
+        metric = self._metrics.get(name)
+        return self.add(name) if metric is None else metric
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._metrics
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._metrics)
+
+    def __len__(self) -> int:
+        return len(self._metrics)
+
+    def keys(self):
+        return self._metrics.keys()
+
+    def items(self):
+        return self._metrics.items()
+
+    def values(self):
+        return self._metrics.values()
+
+    @staticmethod
+    def load_history(path: str) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Load the downsampled history written to the specified file.
+
+        Return
+        -----------
+        For each metric the arrays (count, mean, min, max), one element per block, count being the number of values
+        appended to the metric at the end of the block.
+        """
+        columns: Dict[str, Tuple[list, list, list, list]] = {}
+        with open(path) as fd:
+            for line in fd:
+                if not line.strip():
+                    continue
+                block = json.loads(line)
+                column = columns.setdefault(block["metric"], ([], [], [], []))
+                for i, key in enumerate(("count", "mean", "min", "max")):
+                    column[i].append(block[key])
+        return {name: tuple(np.asarray(c) for c in column) for name, column in columns.items()}
@@ -0,0 +1,176 @@
+from rfl.env.abstract_environment import AbstractEnvironment, Action, State
+from rfl.policies import Policy, BatchPolicy, batch_greedy_action_values
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# (kind, parameters) of a layer, parameters are float32 arrays or small int arrays
+Layer = Tuple[str, Dict[str, np.ndarray]]
+
+
+def _conv2d_(x: np.ndarray, weight: np.ndarray, bias: np.ndarray, stride: np.ndarray, padding: np.ndarray) -> np.ndarray:
+    ph, pw = padding.tolist()
+    if ph or pw:
+        x = np.pad(x, ((0, 0), (0, 0), (ph, ph), (pw, pw)))
+    kh, kw = weight.shape[2:]
+    windows = np.lib.stride_tricks.sliding_window_view(x, (kh, kw), axis=(2, 3))
+    sh, sw = stride.tolist()
+    windows = windows[:, :, ::sh, ::sw]
+    out = np.tensordot(windows, weight, axes=((1, 4, 5), (1, 2, 3)))
+    out += bias
+    return out.transpose(0, 3, 1, 2)
+
+
+class NumpyModel():
+    """
+    Inference-only copy of a sequential torch model that runs with NumPy alone, in float32.
+    For the small networks used on board games the cost of a torch call is larger than the computation itself,
+    and a process using it never has to import torch.
+
+    It is created from a torch model with ```export_numpy_model``` and can be saved to and loaded from a ```.npz``` file.
+    Supported layers: Linear, Conv2d (without dilation or groups), Flatten, ReLU, LeakyReLU, Tanh, Sigmoid, Identity,
+    Dropout, and BatchNorm1d/BatchNorm2d folded with their running statistics.
+
+    Parameters
+    -----------
+    - **layers**: the list of (kind, parameters) of the layers
+    """
+
+    def __init__(self, layers: List[Layer]):
+        self.layers: List[Layer] = layers
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        for kind, params in self.layers:
+            if kind == "linear":
+                x = x @ params["weight_t"]
+                if "bias" in params:
+                    x += params["bias"]
+            elif kind == "conv2d":
+                x = _conv2d_(x, params["weight"], params["bias"], params["stride"], params["padding"])
+            elif kind == "flatten":
+                x = x.reshape(x.shape[0], -1)
+            elif kind == "relu":
+                x = np.maximum(x, 0)
+            elif kind == "leaky_relu":
+                x = np.where(x > 0, x, x * params["slope"])
+            elif kind == "tanh":
+                x = np.tanh(x)
+            elif kind == "sigmoid":
+                x = 1 / (1 + np.exp(-x))
+            elif kind == "affine":
+                x = x * params["scale"] + params["shift"]
+            else:
+                raise ValueError("unknown layer kind: {}".format(kind))
+        return x
+
+    def value_of_state(self, state: State) -> np.ndarray:
+        return self.value_of_states(np.expand_dims(state, axis=0))
+
+    def value_of_states(self, states: List[State]) -> np.ndarray:
+        if len(states) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return self(np.asarray(states))
+
+    def value_of_state_actions(self, env: AbstractEnvironment, state: State, actions: List[Action]) -> np.ndarray:
+        return self.value_of_states([env.get_state_with_action(state.copy(), action) for action in actions])
+
+    @property
+    def greedy_model_policy(self) -> Policy:
+        """
+        Return the greedy policy following this model as a state value model.
+        """
+        def policy(env: AbstractEnvironment) -> Action:
+            s = env.get_state_copy()
+            legal_actions = env.get_possible_actions()
+            return legal_actions[np.argmax(self.value_of_state_actions(env, s, legal_actions))]
+        return policy
+
+    def greedy_model_batch_policy(self, env: AbstractEnvironment) -> BatchPolicy:
+        """
+        Return the batched greedy policy following this model as a state value model, the successors of the states are
+        computed with ```get_states_with_actions``` of the specified environment.
+        """
+        def action_values(states: np.ndarray) -> np.ndarray:
+            successors, _ = env.get_states_with_actions(states)
+            values = self(successors.reshape((-1,) + successors.shape[2:]))
+            return values.reshape(successors.shape[:2])
+        return batch_greedy_action_values(action_values)
+
+    def save(self, path: str):
+        arrays = {"kinds": np.asarray([kind for (kind, _) in self.layers])}
+        for i, (_, params) in enumerate(self.layers):
+            for name, value in params.items():
+                arrays["{}.{}".format(i, name)] = value
+        np.savez(path, **arrays)
+
+    @staticmethod
+    def load(path: str) -> "NumpyModel":
+        with np.load(path, allow_pickle=False) as data:
+            layers: List[Layer] = [(str(kind), {}) for kind in data["kinds"]]
+            for key in data.files:
+                if key != "kinds":
+                    i, name = key.split(".", 1)
+                    layers[int(i)][1][name] = data[key]
+        return NumpyModel(layers)
+
+
+def export_numpy_model(model) -> NumpyModel:
+    """
+    Copy the weights of the specified torch model into a ```NumpyModel```.
+    The model must be a (possibly nested) ```torch.nn.Sequential``` of supported layers or a single supported layer.
+    """
+    import torch.nn as nn
+
+    layers: List[Layer] = []
+
+    def f32(tensor) -> np.ndarray:
+        return tensor.detach().cpu().numpy().astype(np.float32)
+
+    def add(module):
+        if isinstance(module, nn.Sequential):
+            for child in module:
+                add(child)
+        elif isinstance(module, nn.Linear):
+            params = {"weight_t": np.ascontiguousarray(f32(module.weight).T)}
+            if module.bias is not None:
+                params["bias"] = f32(module.bias)
+            layers.append(("linear", params))
+        elif isinstance(module, nn.Conv2d):
+            if module.groups != 1 or tuple(module.dilation) != (1, 1) or not isinstance(module.padding, tuple) \
+                    or module.padding_mode != "zeros":
+                raise ValueError("unsupported Conv2d configuration: {}".format(module))
+            bias = f32(module.bias) if module.bias is not None else np.zeros(module.out_channels, dtype=np.float32)
+            layers.append(("conv2d", {"weight": f32(module.weight), "bias": bias,
+                                      "stride": np.asarray(module.stride, dtype=np.int64),
+                                      "padding": np.asarray(module.padding, dtype=np.int64)}))
+        elif isinstance(module, nn.Flatten):
+            if module.start_dim != 1 or module.end_dim != -1:
+                raise ValueError("unsupported Flatten configuration: {}".format(module))
+            layers.append(("flatten", {}))
+        elif isinstance(module, nn.ReLU):
+            layers.append(("relu", {}))
+        elif isinstance(module, nn.LeakyReLU):
+            layers.append(("leaky_relu", {"slope": np.float32(module.negative_slope)}))
+        elif isinstance(module, nn.Tanh):
+            layers.append(("tanh", {}))
+        elif isinstance(module, nn.Sigmoid):
+            layers.append(("sigmoid", {}))
+        elif isinstance(module, (nn.Identity, nn.Dropout)):
+            pass
+        elif isinstance(module, (nn.BatchNorm1d, nn.BatchNorm2d)):
+            if module.running_var is None:
+                raise ValueError("unsupported BatchNorm without running statistics: {}".format(module))
+            weight = f32(module.weight) if module.affine else np.ones(module.num_features, dtype=np.float32)
+            bias = f32(module.bias) if module.affine else np.zeros(module.num_features, dtype=np.float32)
+            scale = weight / np.sqrt(f32(module.running_var) + module.eps)
+            shift = bias - f32(module.running_mean) * scale
+            if isinstance(module, nn.BatchNorm2d):
+                scale, shift = scale[:, np.newaxis, np.newaxis], shift[:, np.newaxis, np.newaxis]
+            layers.append(("affine", {"scale": scale.astype(np.float32), "shift": shift.astype(np.float32)}))
+        else:
+            raise ValueError("unsupported layer: {}".format(type(module).__name__))
+
+    add(model)
+    return NumpyModel(layers)
@@ -1,11 +1,14 @@
 from rfl.env.abstract_environment import AbstractEnvironment, Action, State
 from rfl.env.abstract_2player_environment import Abstract2PlayerEnvironment
 
-from typing import Callable
+from typing import Callable, Optional
 
 import numpy as np
 
 Policy = Callable[[AbstractEnvironment], Action]
+# Maps a batch of states and their legal actions masks to a batch of actions
+# Masks and actions are indices in the action space of the environment
+BatchPolicy = Callable[[np.ndarray, np.ndarray], np.ndarray]
 
 
 def epsilon_greedy(epsilon: float, greedy_policy: Policy, seed=None) -> Policy:
@@ -28,7 +31,7 @@ def epsilon_greedy(epsilon: float, greedy_policy: Policy, seed=None) -> Policy:
         if generator.uniform() <= epsilon:
             # Random
             actions = list(env.get_possible_actions())
-            return generator.choice(actions)
+            return actions[generator.integers(len(actions))]
         else:
             return greedy_policy(env)
 
@@ -51,12 +54,11 @@ def simple_policy(env: Abstract2PlayerEnvironment, player: int) -> Action:
     """
     actions = list(env.get_possible_actions())
     for action in actions:
-        env.push()
-        env.do_action(action)
-        if env.is_closed() and env.winner == player:
-            env.pop()
+        env.make_move(action)
+        won = env.is_closed() and env.winner == player
+        env.unmake_move()
+        if won:
             return action
-        env.pop()
     return np.random.choice(actions)
 
 
@@ -76,3 +78,145 @@ def greedy_action_values(action_values: Callable[[State], np.ndarray]) -> Policy
         values = action_values(env.get_state_copy())
         return np.argmax(values)
     return f
+
+
+def _random_legal_actions_(masks: np.ndarray, generator: np.random.Generator) -> np.ndarray:
+    # The legal action with the highest uniform draw is uniform among legal actions
+    return np.argmax(np.where(masks, generator.random(masks.shape), -1), axis=1)
+
+
+def batch_random_policy(seed=None) -> BatchPolicy:
+    """
+    Create the batched random policy, it takes a random legal action for each state.
+
+    Parameters
+    -----------
+    - **seed**: the seed to be passed to ```numpy.random.default_rng```
+
+    Return
+    -----------
+    The new batched random policy
+    """
+    generator = np.random.default_rng(seed)
+
+    def f(states: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        return _random_legal_actions_(masks, generator)
+    return f
+
+
+def batch_epsilon_greedy(epsilon: float, greedy_policy: BatchPolicy, seed=None) -> BatchPolicy:
+    """
+    Transform a batched greedy policy into a batched espilon greedy policy.
+    The greedy policy is only called on the states that do not take a random action.
+
+    Parameters
+    -----------
+    - **epsilon**: the chance of taking a random action
+    - **greedy_policy**: the batched greedy policy to follow
+    - **seed**: the seed to be passed to ```numpy.random.default_rng```
+
+    Return
+    -----------
+    The new batched espilon greedy policy
+    """
+    generator = np.random.default_rng(seed)
+
+    def f(states: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        actions = _random_legal_actions_(masks, generator)
+        greedy = generator.uniform(size=masks.shape[0]) > epsilon
+        if np.any(greedy):
+            actions[greedy] = greedy_policy(states[greedy], masks[greedy])
+        return actions
+    return f
+
+
+def batch_simple_policy(env: Abstract2PlayerEnvironment, seed=None) -> BatchPolicy:
+    """
+    Create the batched version of ```simple_policy```: for each state, the first winning legal action if there is one,
+    otherwise a random legal action.
+
+    Parameters
+    -----------
+    - **env**: the environment whose ```get_winning_actions_mask``` finds winning actions
+    - **seed**: the seed to be passed to ```numpy.random.default_rng```
+
+    Return
+    -----------
+    The new batched simple policy
+    """
+    generator = np.random.default_rng(seed)
+
+    def f(states: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        wins = env.get_winning_actions_mask(states) & masks
+        actions = _random_legal_actions_(masks, generator)
+        winning = np.any(wins, axis=1)
+        actions[winning] = np.argmax(wins[winning], axis=1)
+        return actions
+    return f
+
+
+def batch_greedy_action_values(action_values: Callable[[np.ndarray], np.ndarray]) -> BatchPolicy:
+    """
+    Create a batched greedy policy from a batched action values function, only legal actions are considered.
+
+    Parameters
+    -----------
+    - **action_values**: a function that maps a batch of states to the (N, len(action_space)) values of the actions
+
+    Return
+    -----------
+    The new batched greedy action values policy
+    """
+    def f(states: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        values = np.asarray(action_values(states), dtype=np.float64)
+        return np.argmax(np.where(masks, values, -np.inf), axis=1)
+    return f
+
+
+def to_batch_policy(policy: Policy, env: AbstractEnvironment) -> BatchPolicy:
+    """
+    Adapt a policy to the batched protocol, it is called once per state on the specified scratch environment
+    set to that state, whose ```set_state``` must restore the turn.
+
+    Parameters
+    -----------
+    - **policy**: the policy to be adapted
+    - **env**: the environment used to evaluate the policy, it is restored afterwards
+
+    Return
+    -----------
+    The new batched policy
+    """
+    def f(states: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        actions = np.zeros(states.shape[0], dtype=np.int64)
+        env.push()
+        for i, state in enumerate(states):
+            env.set_state(state.copy())
+            # set_state does not clear the winner left by a previous row that ended its game
+            if isinstance(env, Abstract2PlayerEnvironment):
+                env.winner = -1
+            actions[i] = env.action_space.index(policy(env))
+        env.pop()
+        return actions
+    return f
+
+
+def from_batch_policy(batch_policy: BatchPolicy) -> Callable[[AbstractEnvironment, Optional[int]], Action]:
+    """
+    Adapt a batched policy to a policy acting on a single environment.
+    It can be used both as a policy and as a second player with ```attach_second_player```.
+
+    Parameters
+    -----------
+    - **batch_policy**: the batched policy to be adapted
+
+    Return
+    -----------
+    The new policy
+    """
+    def f(env: AbstractEnvironment, player: Optional[int] = None) -> Action:
+        mask = np.zeros((1, len(env.action_space)), dtype=bool)
+        for action in env.get_possible_actions():
+            mask[0, env.action_space.index(action)] = True
+        return env.action_space[int(batch_policy(np.expand_dims(env.get_state_copy(), axis=0), mask)[0])]
+    return f
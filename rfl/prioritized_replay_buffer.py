@@ -1,9 +1,12 @@
 from rfl.env.abstract_environment import Episode
 from rfl.abstract_replay_buffer import AbstractReplayBuffer, SARSTuple
 from rfl.datastructure.ref_counted_list import RefCountedList
+from rfl.deferred import Deferred, resolve_deferred
 from rfl.datastructure.sorted_list import SortedList
+from rfl.datastructure.sum_tree import SumTree, MinTree
+from rfl.state_codec import StateCodec, encode_episode, decode_windows, episodes_to_arrays, arrays_to_episodes
 
-from typing import List, TypeVar, Literal, Optional
+from typing import Dict, List, TypeVar, Literal, Optional
 
 import numpy as np
 
@@ -14,50 +17,146 @@ class PrioritizedReplayBuffer(AbstractReplayBuffer):
 
     def __init__(self, size: int = 10000, method: Method = "proportional",
                  alpha: Optional[float] = None, beta: Optional[float] = None,
-                 seed: int = 0):
+                 seed: int = 0, codec: Optional[StateCodec] = None):
         self._size: int = size
         self._method = method
         self.alpha = alpha or (.7 if method == "rank" else .6)
         self.beta = beta or (.5 if method == "rank" else .4)
         self.epsilon = 10**-3
         self.generator: np.random.Generator = np.random.default_rng(seed)
+        # If a codec is given, episodes are stored encoded and transitions in memories are None
+        self.codec: Optional[StateCodec] = codec
 
-        self._memory: SortedList = SortedList(key=lambda x: x[0])
-        self._episodes: RefCountedList = RefCountedList()
+        # Uids are not recycled, so that (episode_uid, memory_index_in_ep) never identifies two memories, see step
+        self._episodes: RefCountedList = RefCountedList(recycle=False)
+        if method == "rank":
+            # Memories of equal errors are ordered by key so that a memory is found by binary search
+            self._memory: SortedList = SortedList(key=lambda x: x[:3])
+            # A memory is
+            # (error, episode_uid, memory_index_in_ep, transition)
+        else:
+            # Priorities are kept already raised to the power alpha
+            self._priorities: SumTree = SumTree(size)
+            self._min_priorities: MinTree = MinTree(size)
+            self._max_priority: float = self.epsilon ** self.alpha
+            # A memory is
+            # (episode_uid, memory_index_in_ep, transition)
+            self._memory: List = []
 
-        # A memory is
-        # (error, episode_uid, memory_index_in_ep, transition)
+    def __len__(self) -> int:
+        return len(self._memory)
 
     def store(self, episodes: List[Episode]):
+        if self._method == "rank":
+            self._store_ranked_(episodes)
+        else:
+            self._store_proportional_(episodes)
+
+    def _store_ranked_(self, episodes: List[Episode]):
         max_error = (self._memory or ((0,),))[0][0]
         for episode in episodes:
-            uid = self._episodes.append(episode, len(episode))
+            uid = self._add_episode_(episode)
             T = len(episode) - 1
             for j, t in enumerate(reversed(episode)):
-                self._memory.append((max_error, uid, T - j, t))
+                self._memory.append((max_error, uid, T - j, None if self.codec else t))
 
         if len(self._memory) > self._size:
-            for (uid, _, _, _, _) in self._memory[self._size:]:
+            for (_, uid, _, _) in self._memory[self._size:]:
                 self._episodes.decrease_refs(uid, 1)
-            self._memory = self._memory[:self._size]
+            del self._memory[self._size:]
+
+    def _store_proportional_(self, episodes: List[Episode]):
+        # When full, the memory with the lowest priority is replaced
+        priority = self._max_priority
+        for episode in episodes:
+            uid = self._add_episode_(episode)
+            T = len(episode) - 1
+            for j, t in enumerate(reversed(episode)):
+                memory = (uid, T - j, None if self.codec else t)
+                if len(self._memory) < self._size:
+                    index = len(self._memory)
+                    self._memory.append(memory)
+                else:
+                    index = self._min_priorities.argmin()
+                    self._episodes.decrease_refs(self._memory[index][0], 1)
+                    self._memory[index] = memory
+                self._priorities[index] = priority
+                self._min_priorities[index] = priority
+
+    def _add_episode_(self, episode: Episode) -> int:
+        if self.codec:
+            return self._episodes.append(encode_episode(self.codec, episode), len(episode))
+        return self._episodes.append(episode, len(episode))
+
+    def state_dict(self) -> dict:
+        return resolve_deferred(self.deferred_state_dict())
+
+    def deferred_state_dict(self) -> dict:
+        packed = self.codec is not None
+        # Memories are tuples and episodes are not modified once stored, copying the containers is a consistent snapshot
+        memory = list(self._memory)
+        episodes = self._episodes.snapshot()
+        # Memories are (episode_uid, memory_index_in_ep) preceded by the error for the rank method
+        offset = 1 if self._method == "rank" else 0
+        state = {"size": self._size, "method": self._method, "alpha": self.alpha, "beta": self.beta,
+                 "generator": self.generator.bit_generator.state,
+                 "uids": Deferred(lambda: np.asarray([m[offset] for m in memory], dtype=np.int64)),
+                 "indices": Deferred(lambda: np.asarray([m[offset + 1] for m in memory], dtype=np.int64)),
+                 "episodes": Deferred(lambda: episodes.state_dict(lambda elements: episodes_to_arrays(elements, packed)))}
+        if self._method == "rank":
+            state["errors"] = Deferred(lambda: np.asarray([m[0] for m in memory], dtype=np.float64))
+        else:
+            state["priorities"] = self._priorities.state_dict()
+            state["min_priorities"] = self._min_priorities.state_dict()
+            state["max_priority"] = self._max_priority
+        return state
+
+    def load_state_dict(self, state: dict):
+        if state["size"] != self._size or state["method"] != self._method:
+            raise ValueError("cannot load a {} buffer of size {} into a {} buffer of size {}".format(
+                state["method"], state["size"], self._method, self._size))
+        packed = self.codec is not None
+        self.alpha = state["alpha"]
+        self.beta = state["beta"]
+        self.generator.bit_generator.state = state["generator"]
+        self._episodes.load_state_dict(state["episodes"], lambda arrays: arrays_to_episodes(arrays, packed))
+        memories = [(uid, i, None if packed else self._episodes[uid][i])
+                    for uid, i in zip(state["uids"].tolist(), state["indices"].tolist())]
+        if self._method == "rank":
+            self._memory.set_sorted([(error,) + memory for error, memory in zip(state["errors"].tolist(), memories)])
+        else:
+            self._memory = memories
+            self._priorities.load_state_dict(state["priorities"])
+            self._min_priorities.load_state_dict(state["min_priorities"])
+            self._max_priority = state["max_priority"]
 
     def sample(self, size: int, nsteps: int) -> List[SARSTuple]:
         if self._method == "rank":
             probabilities = np.asarray([1 / (i + 1) for i in range(len(self._memory))])
+            probabilities = np.power(probabilities, self.alpha, out=probabilities)
+            probabilities /= np.sum(probabilities)
+            memories = self.generator.choice(np.arange(0, len(self._memory)), size, p=probabilities, shuffle=False)
+            # Importance sampling weights normalized by the maximum weight
+            weights = np.power(probabilities[memories] / np.min(probabilities), -self.beta)
+            memories_data = [self._memory[g_index][1:] for g_index in memories]
         else:
-            probabilities = np.asarray([(-e + self.epsilon) for (e, _, _, _) in self._memory])
-        probabilities = np.power(probabilities, self.alpha, out=probabilities)
-        probabilities /= np.sum(probabilities)
-        memories = self.generator.choice(np.arange(0, len(self._memory)), size, p=probabilities, shuffle=False)
-        self._need_updates = memories
+            memories = self._priorities.sample(size, self.generator)
+            weights = np.power(self._priorities[memories] / self._min_priorities.min(), -self.beta)
+            memories_data = [self._memory[g_index] for g_index in memories]
+        # Memories are identified by their key (episode_uid, memory_index_in_ep) as their position may change
+        self._sampled: Dict[str, np.ndarray] = {
+            "positions": np.asarray(memories, dtype=np.int64),
+            "uids": np.fromiter((memory[0] for memory in memories_data), dtype=np.int64, count=len(memories_data)),
+            "indices": np.fromiter((memory[1] for memory in memories_data), dtype=np.int64, count=len(memories_data))}
+        if self._method == "rank":
+            self._sampled["errors"] = np.fromiter((self._memory[g_index][0] for g_index in memories), dtype=np.float64,
+                                                  count=len(memories_data))
+        if self.codec:
+            windows = [(self._episodes[episode_uid], memory_index) for (episode_uid, memory_index, _) in memories_data]
+            return decode_windows(self.codec, windows, nsteps, weights)
         # Now retrieve
         output = []
-        weights = []
-        probabilities *= size
-        weights = np.power(probabilities, -self.beta, out=probabilities)
-        weights /= np.max(weights)
-        for g_index in memories:
-            (_, episode_uid, memory_index, t) = self._memory[g_index]
+        for (episode_uid, memory_index, t), w in zip(memories_data, weights):
             (state, action, reward) = t
             afterwards = []
             episode = self._episodes[episode_uid]
@@ -66,12 +165,47 @@ class PrioritizedReplayBuffer(AbstractReplayBuffer):
             for j in range(1, nsteps + 1):
                 if i + j < len(episode):
                     afterwards.append(episode[i + j])
-            output.append((state, action, reward, afterwards, weights[g_index]))
+            output.append((state, action, reward, afterwards, w))
         return output
 
-    def step(self, losses: np.ndarray, beta: float):
-        for i in range(losses.shape[0]):
-            index = self._need_updates[i]
-            (_, uid, i, t) = self._memory[index]
-            self._memory.replace(index, (-losses[i], uid, i, t))
+    def sampled_memories(self) -> Dict[str, np.ndarray]:
+        """
+        Return the positions and keys of the memories of the last sample, to update their priorities with ```step```
+        after other memories were stored.
+        """
+        return dict(self._sampled)
+
+    def _locate_ranked_(self, uid: int, i: int, error: float) -> Optional[int]:
+        # Positions shift when memories are stored or replaced, the memory is found by its error and key instead
+        start, end = self._memory.equal_range((error, uid, i))
+        return start if start < end else None
+
+    def step(self, losses: np.ndarray, beta: float, memories: Optional[Dict[str, np.ndarray]] = None):
+        """
+        Update the priorities of sampled memories with their losses.
+
+        Parameters
+        -----------
+        - **losses**: the losses of the sampled transitions
+        - **beta**: the new importance sampling exponent
+        - **memories**: the memories the losses are of as returned by ```sampled_memories```, the ones of the last sample
+        by default. Memories evicted since they were sampled are skipped.
+        """
+        sampled = self._sampled if memories is None else memories
+        keys = zip(sampled["positions"].tolist(), sampled["uids"].tolist(), sampled["indices"].tolist())
+        if self._method == "rank":
+            for k, ((_, uid, i), error) in enumerate(zip(keys, sampled["errors"].tolist())):
+                index = self._locate_ranked_(uid, i, error)
+                if index is not None:
+                    (_, _, _, t) = self._memory[index]
+                    self._memory.replace(index, (-losses[k], uid, i, t))
+        else:
+            valid = [k for k, (position, uid, i) in enumerate(keys)
+                     if self._memory[position][0] == uid and self._memory[position][1] == i]
+            if valid:
+                priorities = np.power(np.abs(np.asarray(losses)[valid]) + self.epsilon, self.alpha)
+                positions = sampled["positions"][valid]
+                self._priorities.update(positions, priorities)
+                self._min_priorities.update(positions, priorities)
+                self._max_priority = max(self._max_priority, np.max(priorities))
         self.beta = beta
@@ -0,0 +1,426 @@
+from rfl.env.abstract_environment import Episode
+from rfl.abstract_replay_buffer import AbstractReplayBuffer, SARSTuple
+from rfl.instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from rfl.state_codec import episodes_to_arrays, arrays_to_episodes
+
+from typing import Dict, List, Optional, Tuple, Union
+
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+# (host, port) of a TCP socket or path of a Unix socket
+Address = Union[Tuple[str, int], str]
+# (header, arrays) of a message
+Message = Tuple[dict, Dict[str, np.ndarray]]
+
+# Payload length and flags of a frame
+_FRAME = struct.Struct("<QB")
+_COMPRESSED = 1
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+def _recv_exact_(sock: socket.socket, n: int) -> Optional[bytearray]:
+    data = bytearray(n)
+    view = memoryview(data)
+    received = 0
+    while received < n:
+        k = sock.recv_into(view[received:])
+        if k == 0:
+            if received == 0:
+                return None
+            raise ConnectionError("connection closed in the middle of a message")
+        received += k
+    return data
+
+
+def _send_message_(sock: socket.socket, header: dict, arrays: Dict[str, np.ndarray], compression: int):
+    """
+    Send a message made of a JSON header and raw numpy arrays, compressed with zlib if **compression** is positive.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            raise ValueError("cannot send the array {} of dtype object".format(name))
+    header = dict(header, arrays=[[name, array.dtype.str, list(array.shape)] for name, array in arrays.items()])
+    encoded = json.dumps(header).encode()
+    parts = [_HEADER_LENGTH.pack(len(encoded)), encoded] + [memoryview(array.reshape(-1)).cast("B") for array in arrays.values()]
+    flags = 0
+    if compression > 0:
+        compressor = zlib.compressobj(compression)
+        parts = [compressor.compress(part) for part in parts] + [compressor.flush()]
+        flags = _COMPRESSED
+    sock.sendall(_FRAME.pack(sum(len(part) for part in parts), flags))
+    for part in parts:
+        sock.sendall(part)
+
+
+def _receive_message_(sock: socket.socket) -> Optional[Tuple[dict, Dict[str, np.ndarray], bool]]:
+    """
+    Receive a message sent by ```_send_message_```.
+
+    Return
+    -----------
+    The header, the arrays and whether the message was compressed, None if the connection was closed.
+    """
+    frame = _recv_exact_(sock, _FRAME.size)
+    if frame is None:
+        return None
+    length, flags = _FRAME.unpack(frame)
+    payload = _recv_exact_(sock, length) if length > 0 else bytearray()
+    if payload is None:
+        raise ConnectionError("connection closed in the middle of a message")
+    compressed = bool(flags & _COMPRESSED)
+    if compressed:
+        payload = bytearray(zlib.decompress(payload))
+    (header_length,) = _HEADER_LENGTH.unpack_from(payload)
+    offset = _HEADER_LENGTH.size + header_length
+    header = json.loads(bytes(payload[_HEADER_LENGTH.size:offset]))
+    arrays = {}
+    for name, dtype, shape in header.pop("arrays"):
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape, dtype=np.int64))
+        arrays[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+        offset += count * dtype.itemsize
+    return header, arrays, compressed
+
+
+def pack_transitions(transitions: List[SARSTuple]) -> Dict[str, np.ndarray]:
+    """
+    Pack the specified transitions into flat arrays, the next transitions of all of them being concatenated.
+
+    Return
+    -----------
+    The dictionary of arrays (states, actions, rewards, next_states, next_actions, next_rewards, lengths), with the
+    weights of the transitions if they have some.
+    """
+    states = np.asarray([state for (state, _, _, _, _) in transitions])
+    afterwards = [t for (_, _, _, after, _) in transitions for t in after]
+    arrays = {"states": states,
+              "actions": np.asarray([action for (_, action, _, _, _) in transitions]),
+              "rewards": np.asarray([reward for (_, _, reward, _, _) in transitions], dtype=np.float64),
+              "next_states": np.asarray([state for (state, _, _) in afterwards]) if afterwards
+              else np.zeros((0,) + states.shape[1:], dtype=states.dtype),
+              "next_actions": np.asarray([action for (_, action, _) in afterwards]),
+              "next_rewards": np.asarray([reward for (_, _, reward) in afterwards], dtype=np.float64),
+              "lengths": np.asarray([len(after) for (_, _, _, after, _) in transitions], dtype=np.int64)}
+    if transitions and all(w is not None for (_, _, _, _, w) in transitions):
+        arrays["weights"] = np.asarray([w for (_, _, _, _, w) in transitions], dtype=np.float64)
+    return arrays
+
+
+def pack_transition_batch(batch: tuple) -> Dict[str, np.ndarray]:
+    """
+    Pack the arrays returned by ```RingReplayBuffer.sample_batch``` like ```pack_transitions```, without building the transitions.
+    """
+    states, actions, rewards, next_states, next_actions, next_rewards, lengths = batch
+    keep = np.arange(next_actions.shape[1]) < lengths[:, np.newaxis]
+    return {"states": states, "actions": actions, "rewards": rewards.astype(np.float64, copy=False),
+            "next_states": next_states[keep], "next_actions": next_actions[keep],
+            "next_rewards": next_rewards[keep].astype(np.float64, copy=False), "lengths": lengths.astype(np.int64, copy=False)}
+
+
+def unpack_transitions(arrays: Dict[str, np.ndarray]) -> List[SARSTuple]:
+    """
+    Build the transitions packed by ```pack_transitions```.
+    """
+    next_states = list(arrays["next_states"])
+    next_actions, next_rewards = arrays["next_actions"].tolist(), arrays["next_rewards"].tolist()
+    weights = arrays["weights"].tolist() if "weights" in arrays else [None] * arrays["lengths"].shape[0]
+    output = []
+    start = 0
+    for state, action, reward, length, w in zip(list(arrays["states"]), arrays["actions"].tolist(),
+                                                arrays["rewards"].tolist(), arrays["lengths"].tolist(), weights):
+        end = start + length
+        output.append((state, action, reward, list(zip(next_states[start:end], next_actions[start:end], next_rewards[start:end])), w))
+        start = end
+    return output
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        if self.request.family != socket.AF_UNIX:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        service: "ReplayServer" = self.server.service
+        while True:
+            try:
+                message = _receive_message_(self.request)
+            except ConnectionError:
+                return
+            if message is None:
+                return
+            header, arrays, compressed = message
+            try:
+                result, output = service._handle_(header, arrays)
+                response = {"ok": True, "result": result}
+            except Exception as e:
+                response, output = {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}, {}
+            _send_message_(self.request, response, output, service.compression if compressed else 0)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class ReplayServer():
+    """
+    Serves a replay buffer over a TCP or Unix socket so that actors on other processes or machines store episodes into it
+    and a learner samples from it, through ```ReplayClient```.
+
+    Each connection is served by its own thread and requests are applied to the buffer one at a time.
+    Messages are a JSON header followed by raw numpy arrays, compressed with zlib when the client compresses its requests:
+    episodes are uploaded as the flat arrays of ```episodes_to_arrays``` and sampled transitions are returned packed
+    by ```pack_transitions```, or directly from ```sample_batch``` for buffers that have it.
+    Nothing is unpickled, but there is no authentication either, so it must only listen on a trusted network.
+
+    Parameters
+    -----------
+    - **buffer**: the replay buffer served
+    - **address**: (host, port) to listen on TCP, port 0 picking a free port, or the path of a Unix socket
+    - **compression**: the zlib level of the responses to compressed requests
+    """
+
+    def __init__(self, buffer: AbstractReplayBuffer, address: Address = ("127.0.0.1", 0), compression: int = 1):
+        self.buffer: AbstractReplayBuffer = buffer
+        self.compression: int = compression
+        self.instrumentation: Instrumentation = NULL_INSTRUMENTATION
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._serving: bool = False
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self._server = _UnixServer(address, _ConnectionHandler)
+        else:
+            self._server = _TCPServer(tuple(address), _ConnectionHandler)
+        self._server.service = self
+
+    @property
+    def address(self) -> Address:
+        """
+        The address the server listens on, with the actual port if port 0 was given.
+        """
+        return self._server.server_address
+
+    def serve_forever(self):
+        """
+        Serve in the calling thread until ```stop``` is called from another thread.
+        """
+        self._serving = True
+        self._server.serve_forever()
+
+    def start(self) -> "ReplayServer":
+        """
+        Serve in a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._serving:
+            self._server.shutdown()
+            self._serving = False
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def __enter__(self) -> "ReplayServer":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _handle_(self, header: dict, arrays: Dict[str, np.ndarray]) -> Tuple[dict, Dict[str, np.ndarray]]:
+        op = header["op"]
+        with self._lock:
+            if op == "store":
+                episodes = arrays_to_episodes(arrays)
+                with self.instrumentation.timer("replay_service.store"):
+                    self.buffer.store(episodes)
+                self.instrumentation.count("replay_service.episodes", len(episodes))
+                return {}, {}
+            if op == "sample":
+                with self.instrumentation.timer("replay_service.sample"):
+                    if hasattr(self.buffer, "sample_batch"):
+                        packed = pack_transition_batch(self.buffer.sample_batch(header["size"], header["nsteps"]))
+                    else:
+                        packed = pack_transitions(self.buffer.sample(header["size"], header["nsteps"]))
+                if hasattr(self.buffer, "sampled_memories"):
+                    # Sent back with step so that the priorities of exactly these memories are updated
+                    for name, array in self.buffer.sampled_memories().items():
+                        packed["memory." + name] = array
+                return {}, packed
+            if op == "step":
+                memories = {name[len("memory."):]: array for name, array in arrays.items() if name.startswith("memory.")}
+                if memories:
+                    self.buffer.step(arrays["losses"], header["beta"], memories)
+                else:
+                    self.buffer.step(arrays["losses"], header["beta"])
+                return {}, {}
+            if op == "length":
+                return {"length": len(self.buffer)}, {}
+        raise ValueError("unknown operation: {}".format(op))
+
+
+class ReplayClient(AbstractReplayBuffer):
+    """
+    Replay buffer whose episodes are stored in and sampled from the buffer of a ```ReplayServer```,
+    so that it can replace a local buffer in a learner.
+
+    Episodes are sent once at least **store_batch** of them are pending, pending episodes are sent before any other request
+    and when the client is closed. If sending them fails they stay pending.
+    Requests are thread safe. The connection is opened on first use and opened again in a forked process,
+    copies of the client do not share the connection.
+
+    Parameters
+    -----------
+    - **address**: the address of the server
+    - **compression**: the zlib level of the requests, 0 to send them uncompressed
+    - **store_batch**: the number of episodes gathered before they are sent
+    - **timeout**: the timeout in seconds of socket operations, None to wait forever
+    """
+
+    def __init__(self, address: Address, compression: int = 1, store_batch: int = 1, timeout: Optional[float] = None):
+        self.address: Address = address if isinstance(address, str) else tuple(address)
+        self.compression: int = compression
+        self.store_batch: int = store_batch
+        self.timeout: Optional[float] = timeout
+        self._pending: List[Episode] = []
+        # Memories of the last sample
+        self._sampled: Dict[str, np.ndarray] = {}
+        self._socket: Optional[socket.socket] = None
+        self._pid: int = os.getpid()
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = dict(self.__dict__)
+        state["_socket"], state["_lock"] = None, None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect_(self) -> socket.socket:
+        if self._socket is not None and self._pid == os.getpid():
+            return self._socket
+        # The connection of the parent process is left to it
+        self._pid = os.getpid()
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        sock.connect(self.address)
+        self._socket = sock
+        return sock
+
+    def _request_(self, header: dict, arrays: Dict[str, np.ndarray]) -> Message:
+        with self._lock:
+            if self._pending:
+                self._send_pending_()
+            return self._call_(header, arrays)
+
+    def _call_(self, header: dict, arrays: Dict[str, np.ndarray]) -> Message:
+        sock = self._connect_()
+        try:
+            _send_message_(sock, header, arrays, self.compression)
+            response = _receive_message_(sock)
+        except BaseException:
+            # The stream may hold a partial message
+            self._disconnect_()
+            raise
+        if response is None:
+            self._disconnect_()
+            raise ConnectionError("the replay server closed the connection")
+        header, arrays, _ = response
+        if not header["ok"]:
+            raise RuntimeError("replay server error: {}".format(header["error"]))
+        return header["result"], arrays
+
+    def _send_pending_(self):
+        episodes, self._pending = self._pending, []
+        try:
+            self._call_({"op": "store"}, episodes_to_arrays(episodes))
+        except BaseException:
+            # Kept to be sent again by the next request
+            self._pending = episodes + self._pending
+            raise
+
+    def _disconnect_(self):
+        if self._socket is not None and self._pid == os.getpid():
+            self._socket.close()
+        self._socket = None
+
+    def close(self):
+        """
+        Send the pending episodes and close the connection.
+        """
+        with self._lock:
+            if self._pending:
+                self._send_pending_()
+            self._disconnect_()
+
+    def state_dict(self) -> dict:
+        """
+        Return the configuration of this client and its pending episodes,
+        the buffer of the server is not part of the state: it is checkpointed on the side of the server.
+        """
+        with self._lock:
+            return {"address": self.address, "compression": self.compression, "store_batch": self.store_batch,
+                    "pending": episodes_to_arrays(self._pending)}
+
+    def load_state_dict(self, state: dict):
+        """
+        Restore the pending episodes and the configuration of the specified state, the address of this client is kept.
+        """
+        with self._lock:
+            self.compression = state["compression"]
+            self.store_batch = state["store_batch"]
+            self._pending = arrays_to_episodes(state["pending"])
+
+    def __len__(self) -> int:
+        return self._request_({"op": "length"}, {})[0]["length"]
+
+    def store(self, episodes: List[Episode]):
+        with self._lock:
+            self._pending.extend(episodes)
+            if len(self._pending) >= self.store_batch:
+                self._send_pending_()
+
+    def flush(self):
+        """
+        Send the pending episodes.
+        """
+        with self._lock:
+            if self._pending:
+                self._send_pending_()
+
+    def sample(self, size: int, nsteps: int) -> List[SARSTuple]:
+        arrays = self._request_({"op": "sample", "size": size, "nsteps": nsteps}, {})[1]
+        self._sampled = {name: array for name, array in arrays.items() if name.startswith("memory.")}
+        return unpack_transitions(arrays)
+
+    def step(self, losses: np.ndarray, beta: float):
+        """
+        Update the priorities of the transitions of the last sample of this client in the served ```PrioritizedReplayBuffer```,
+        even if other clients stored or sampled meanwhile.
+        """
+        self._request_({"op": "step", "beta": beta}, dict(self._sampled, losses=np.asarray(losses, dtype=np.float64)))
@@ -0,0 +1,126 @@
+from rfl.env.abstract_environment import Episode
+from rfl.abstract_replay_buffer import AbstractReplayBuffer, SARSTuple
+from rfl.state_codec import StateCodec
+
+from typing import List, Tuple, Optional
+
+import numpy as np
+
+# (states, actions, rewards, next_states, next_actions, next_rewards, lengths)
+# next_* arrays have shape (size, nsteps, ...), only the first lengths[i] next transitions of sample i are valid
+SARSBatch = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+class RingReplayBuffer(AbstractReplayBuffer):
+    """
+    Uniform replay buffer backed by preallocated arrays used as a ring buffer.
+
+    Transitions are written in the order of their episodes, along with the number of transitions that follow them
+    in their episode, so that the n-step windows of a batch are gathered with one fancy indexing pass.
+    When full, the oldest transitions are overwritten.
+    The states array is allocated on the first call to ```store```, from the shape and dtype of the first state.
+    If a codec is given, states are stored encoded and the states of a sampled batch are decoded at once.
+    """
+
+    def __init__(self, size: int = 10000, seed: int = 0, codec: Optional[StateCodec] = None):
+        self._size: int = size
+        self.generator: np.random.Generator = np.random.default_rng(seed)
+        self.codec: Optional[StateCodec] = codec
+        self._head: int = 0
+        self._count: int = 0
+        self._states: np.ndarray = None
+        self._actions: np.ndarray = self._allocate_("actions", (size,), np.int64)
+        self._rewards: np.ndarray = self._allocate_("rewards", (size,), np.float64)
+        # Number of transitions after this one in its episode, 0 marks the end of an episode
+        self._remaining: np.ndarray = self._allocate_("remaining", (size,), np.int64)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _allocate_(self, name: str, shape: Tuple[int, ...], dtype) -> np.ndarray:
+        return np.zeros(shape, dtype=dtype)
+
+    def _allocate_states_(self, state: np.ndarray):
+        self._states = self._allocate_("states", (self._size,) + state.shape, state.dtype)
+
+    def _sample_indices_(self, size: int) -> np.ndarray:
+        return self.generator.integers(0, self._count, size)
+
+    def store(self, episodes: List[Episode]):
+        episodes = [episode for episode in episodes if episode]
+        if not episodes:
+            return
+        states = np.asarray([state for episode in episodes for (state, _, _) in episode])
+        if self.codec:
+            states = self.codec.encode(states)
+        if self._states is None:
+            self._allocate_states_(states[0])
+        actions = np.asarray([action for episode in episodes for (_, action, _) in episode])
+        rewards = np.asarray([reward for episode in episodes for (_, _, reward) in episode])
+        remaining = np.concatenate([np.arange(len(episode) - 1, -1, -1) for episode in episodes])
+        n = states.shape[0]
+        if n > self._size:
+            states, actions, rewards, remaining = states[-self._size:], actions[-self._size:], rewards[-self._size:], remaining[-self._size:]
+            self._head = (self._head + n - self._size) % self._size
+            n = self._size
+        positions = (self._head + np.arange(n)) % self._size
+        self._states[positions] = states
+        self._actions[positions] = actions
+        self._rewards[positions] = rewards
+        self._remaining[positions] = remaining
+        self._head = (self._head + n) % self._size
+        self._count = min(self._count + n, self._size)
+
+    def state_dict(self) -> dict:
+        return {"size": self._size, "head": self._head, "count": self._count, "generator": self.generator.bit_generator.state,
+                "states": self._states, "actions": self._actions, "rewards": self._rewards, "remaining": self._remaining}
+
+    def load_state_dict(self, state: dict):
+        if state["size"] != self._size:
+            raise ValueError("cannot load a buffer of size {} into a buffer of size {}".format(state["size"], self._size))
+        self._head = state["head"]
+        self._count = state["count"]
+        self.generator.bit_generator.state = state["generator"]
+        if state["states"] is not None:
+            self._allocate_states_(state["states"][0])
+            self._states[:] = state["states"]
+        self._actions[:] = state["actions"]
+        self._rewards[:] = state["rewards"]
+        self._remaining[:] = state["remaining"]
+
+    def sample_batch(self, size: int, nsteps: int) -> SARSBatch:
+        """
+        Sample the specified number of transitions from this buffer as arrays.
+
+        Parameters
+        -----------
+        - **size**: the number of transitions to be sampled
+        - **nsteps**: the number of future steps to get
+
+        Return
+        -----------
+        The tuple (states, actions, rewards, next_states, next_actions, next_rewards, lengths).
+        """
+        indices = self._sample_indices_(size)
+        # Column 0 is the sampled transition, the next ones are the transitions after it
+        window = (indices[:, np.newaxis] + np.arange(0, nsteps + 1)) % self._size
+        lengths = np.minimum(self._remaining[indices], nsteps)
+        states = self._states[window]
+        if self.codec:
+            decoded = self.codec.decode(states.reshape((-1,) + states.shape[2:]))
+            states = decoded.reshape((size, nsteps + 1) + decoded.shape[1:])
+        after = window[:, 1:]
+        return (states[:, 0], self._actions[indices], self._rewards[indices],
+                states[:, 1:], self._actions[after], self._rewards[after], lengths)
+
+    def sample(self, size: int, nsteps: int) -> List[SARSTuple]:
+        states, actions, rewards, next_states, next_actions, next_rewards, lengths = self.sample_batch(size, nsteps)
+        next_states = list(next_states.reshape((-1,) + next_states.shape[2:]))
+        next_actions, next_rewards = next_actions.reshape(-1).tolist(), next_rewards.reshape(-1).tolist()
+        output = []
+        start = 0
+        for state, action, reward, length in zip(list(states), actions.tolist(), rewards.tolist(), lengths.tolist()):
+            afterwards = list(zip(next_states[start:start + length], next_actions[start:start + length], next_rewards[start:start + length]))
+            output.append((state, action, reward, afterwards, None))
+            start += nsteps
+        return output
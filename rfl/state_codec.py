@@ -0,0 +1,122 @@
+from rfl.env.abstract_environment import Episode
+from rfl.abstract_replay_buffer import SARSTuple
+
+from abc import ABC, abstractmethod
+from typing import List, Tuple, Optional, Iterable
+from itertools import repeat
+
+import numpy as np
+
+# (packed states, actions, rewards) of an episode
+PackedEpisode = Tuple[np.ndarray, List, List]
+
+
+class StateCodec(ABC):
+    """
+    Compact encoding of states used by replay buffers to store them.
+    """
+
+    @abstractmethod
+    def encode(self, states: np.ndarray) -> np.ndarray:
+        """
+        Encode the specified batch of states.
+
+        Parameters
+        -----------
+        - **states**: the (N, ...) states
+
+        Return
+        -----------
+        The (N, ...) encoded states.
+        """
+        pass
+
+    @abstractmethod
+    def decode(self, encoded: np.ndarray) -> np.ndarray:
+        """
+        Decode the specified batch of encoded states.
+
+        Parameters
+        -----------
+        - **encoded**: the (N, ...) encoded states
+
+        Return
+        -----------
+        The (N, ...) states as a float32 array.
+        """
+        pass
+
+
+def encode_episode(codec: StateCodec, episode: Episode) -> PackedEpisode:
+    """
+    Encode the states of the specified episode.
+    """
+    return (codec.encode(np.asarray([state for (state, _, _) in episode])),
+            [action for (_, action, _) in episode], [reward for (_, _, reward) in episode])
+
+
+def episodes_to_arrays(episodes: List, packed: bool = False) -> dict:
+    """
+    Concatenate the specified episodes into flat arrays of states, actions and rewards with the length of each episode.
+
+    Parameters
+    -----------
+    - **episodes**: the list of episodes
+    - **packed**: whether the episodes are ```PackedEpisode```
+
+    Return
+    -----------
+    The dictionary of arrays (states, actions, rewards, lengths).
+    """
+    if packed:
+        columns = episodes
+    else:
+        columns = [([state for (state, _, _) in episode], [action for (_, action, _) in episode],
+                    [reward for (_, _, reward) in episode]) for episode in episodes]
+    states = [np.asarray(states) for (states, _, _) in columns if len(states) > 0]
+    return {"states": np.concatenate(states) if states else np.zeros(0),
+            "actions": np.asarray([action for (_, actions, _) in columns for action in actions]),
+            "rewards": np.asarray([reward for (_, _, rewards) in columns for reward in rewards], dtype=np.float64),
+            "lengths": np.asarray([len(actions) for (_, actions, _) in columns], dtype=np.int64)}
+
+
+def arrays_to_episodes(arrays: dict, packed: bool = False) -> List:
+    """
+    Split the arrays produced by ```episodes_to_arrays``` back into episodes.
+    """
+    bounds = np.cumsum(arrays["lengths"])[:-1]
+    states = np.split(arrays["states"], bounds) if arrays["lengths"].shape[0] > 0 else []
+    actions = np.split(arrays["actions"], bounds)
+    rewards = np.split(arrays["rewards"], bounds)
+    if packed:
+        return [(s, a.tolist(), r.tolist()) for s, a, r in zip(states, actions, rewards)]
+    return [list(zip(list(s), a.tolist(), r.tolist())) for s, a, r in zip(states, actions, rewards)]
+
+
+def decode_windows(codec: StateCodec, windows: List[Tuple[PackedEpisode, int]], nsteps: int,
+                   weights: Optional[Iterable[float]] = None) -> List[SARSTuple]:
+    """
+    Decode the transitions starting at the specified indices of the specified episodes along with their next nsteps transitions,
+    all states are decoded at once.
+
+    Parameters
+    -----------
+    - **codec**: the codec used to encode the episodes
+    - **windows**: the list of (episode, index of the transition in the episode)
+    - **nsteps**: the number of future steps to get
+    - **weights**: the weights of the transitions, None by default
+
+    Return
+    -----------
+    The list of transitions.
+    """
+    rows = [packed[i:i + nsteps + 1] for ((packed, _, _), i) in windows]
+    states = codec.decode(np.concatenate(rows))
+    output = []
+    offset = 0
+    for ((_, actions, rewards), i), row, w in zip(windows, rows, repeat(None) if weights is None else weights):
+        n = row.shape[0]
+        afterwards = [(states[offset + j], actions[i + j], rewards[i + j]) for j in range(1, n)]
+        output.append((states[offset], actions[i], rewards[i], afterwards, w))
+        offset += n
+    return output
@@ -0,0 +1,248 @@
+from rfl.env.abstract_environment import Action
+from rfl.env.abstract_2player_environment import Abstract2PlayerEnvironment
+from rfl.learner.abstract_model_learner import AbstractModelLearner
+from rfl.policies import Policy
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+import multiprocessing
+import os
+
+import numpy as np
+
+# Chooses the action of the specified player
+Player = Callable[[Abstract2PlayerEnvironment, int], Action]
+# Builds a player from its seed, called once per batch of games
+Entrant = Callable[[int], Player]
+# Builds an environment whose player is the specified seat
+EnvFactory = Callable[[int], Abstract2PlayerEnvironment]
+
+WIN, DRAW, LOSS = 0, 1, 2
+
+# Tournament of the current worker process, inherited from the parent when forking
+_worker_tournament: Optional["Tournament"] = None
+
+
+def policy_entrant(policy: Policy) -> Entrant:
+    """
+    Create an entrant from a policy that only takes the environment, such as ```random_policy```.
+    """
+    return lambda seed: lambda env, player: policy(env)
+
+
+def player_entrant(player: Player) -> Entrant:
+    """
+    Create an entrant from a function that takes the environment and the player, such as ```simple_policy```.
+    """
+    return lambda seed: player
+
+
+def checkpoint_entrant(make_learner: Callable[[], AbstractModelLearner], directory: str) -> Entrant:
+    """
+    Create an entrant playing the greedy policy of the learner restored from the latest checkpoint of the specified directory.
+    The learner is restored once per process.
+
+    Parameters
+    -----------
+    - **make_learner**: builds the learner the checkpoint is loaded into
+    - **directory**: the directory of the checkpoints
+    """
+    learners: Dict[int, AbstractModelLearner] = {}
+
+    def entrant(seed: int) -> Player:
+        from rfl.checkpoint import load_checkpoint
+        # Keyed by process as forked workers inherit the learners of their parent
+        pid = os.getpid()
+        if pid not in learners:
+            learner = make_learner()
+            load_checkpoint(learner, directory, restore_random=False)
+            learners[pid] = learner
+        policy = learners[pid].greedy_model_policy
+        return lambda env, player: policy(env)
+    return entrant
+
+
+def _init_worker_(tournament: "Tournament"):
+    global _worker_tournament
+    _worker_tournament = tournament
+
+
+def _worker_games_(task: tuple) -> Tuple[int, int, int, np.ndarray]:
+    return _worker_tournament._play_task_(task)
+
+
+class Tournament():
+    """
+    Round-robin tournament between entrants on a 2 player environment, each pair plays **games** games
+    with each entrant in each seat.
+
+    The entrant in the seat of the environment plays as its policy and its opponent is attached with ```attach_second_player```.
+    The first **random_opening** plies of every game are random so that deterministic entrants do not replay the same game.
+    Games are spread over a fork-based process pool by batches. For every batch the entrants are built with seeds derived
+    from the seed of the batch and the global PRNG of numpy is reseeded, so that outcomes only depend on **seed**
+    and not on how batches are scheduled over the workers.
+
+    Parameters
+    -----------
+    - **entrants**: the entrants by name
+    - **env_factory**: builds an environment whose player is the specified seat
+    - **games**: the number of games per pair and per seat
+    - **random_opening**: the number of random plies at the start of every game
+    - **seed**: the seed of the tournament
+    """
+
+    def __init__(self, entrants: Dict[str, Entrant], env_factory: EnvFactory, games: int = 50,
+                 random_opening: int = 2, seed: int = 0):
+        self.names: List[str] = list(entrants.keys())
+        self.entrants: List[Entrant] = list(entrants.values())
+        self.env_factory: EnvFactory = env_factory
+        self.games: int = games
+        self.random_opening: int = random_opening
+        self.seed: int = seed
+        n = len(self.names)
+        # outcomes[i, j, seat] counts the wins, draws and losses of i against j when i plays in the specified seat
+        self.outcomes: np.ndarray = np.zeros((n, n, 2, 3), dtype=np.int64)
+
+    def _tasks_(self, batch: int) -> List[tuple]:
+        tasks = []
+        n = len(self.names)
+        for i in range(n):
+            for j in range(i + 1, n):
+                for seat in range(2):
+                    for start in range(0, self.games, batch):
+                        tasks.append((i, j, seat, min(batch, self.games - start)))
+        seeds = np.random.SeedSequence(self.seed).generate_state(len(tasks))
+        return [task + (int(seed),) for task, seed in zip(tasks, seeds)]
+
+    def _play_task_(self, task: tuple) -> Tuple[int, int, int, np.ndarray]:
+        i, j, seat, games, seed = task
+        seeds = np.random.SeedSequence(seed).generate_state(2)
+        players = {k: self.entrants[k](int(entrant_seed)) for k, entrant_seed in zip((i, j), seeds)}
+        np.random.seed(seed)
+        generator = np.random.default_rng(seed)
+        env = self.env_factory(seat)
+        counts = np.zeros(3, dtype=np.int64)
+        for _ in range(games):
+            plies = [0]
+
+            def with_opening(player: Player) -> Player:
+                def f(env: Abstract2PlayerEnvironment, turn: int) -> Action:
+                    plies[0] += 1
+                    if plies[0] <= self.random_opening:
+                        return generator.choice(list(env.get_possible_actions()))
+                    return player(env, turn)
+                return f
+
+            me, opponent = with_opening(players[i]), with_opening(players[j])
+            env.attach_second_player(opponent)
+            env.reset()
+            reward = 0
+            while not env.is_closed():
+                reward = env.do_action(me(env, env.player))
+            counts[WIN if reward == env.win_reward else (LOSS if reward == -env.win_reward else DRAW)] += 1
+        return i, j, seat, counts
+
+    def run(self, processes: Optional[int] = None, batch: int = 10) -> "Tournament":
+        """
+        Play all the games of the tournament and add their outcomes to **outcomes**.
+
+        Parameters
+        -----------
+        - **processes**: the number of worker processes, the number of CPUs by default, 1 to play in this process
+        - **batch**: the number of games per task sent to a worker
+
+        Return
+        -----------
+        This tournament
+        """
+        tasks = self._tasks_(batch)
+        if processes == 1:
+            results = [self._play_task_(task) for task in tasks]
+        else:
+            context = multiprocessing.get_context("fork")
+            with context.Pool(processes, initializer=_init_worker_, initargs=(self,)) as pool:
+                results = pool.map(_worker_games_, tasks, chunksize=1)
+        for i, j, seat, counts in results:
+            self.outcomes[i, j, seat] += counts
+            # The outcome of j is the opposite, in the other seat
+            self.outcomes[j, i, 1 - seat] += counts[::-1]
+        return self
+
+    def scores(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the (n, n) matrix of the number of games between each pair and the (n, n) matrix of the points of the first
+        entrant against the second one, a win being worth 1 and a draw 1/2.
+        """
+        totals = self.outcomes.sum(axis=2)
+        return totals.sum(axis=2), totals[..., WIN] + totals[..., DRAW] / 2
+
+    def elo(self, anchor: Optional[str] = None, anchor_rating: float = 0, virtual_draws: float = 1,
+            confidence: float = 1.96) -> Dict[str, Tuple[float, float]]:
+        """
+        Fit Elo ratings to the outcomes by maximum likelihood with Newton's method.
+
+        Draws count as half a win. Each pair that played is given **virtual_draws** additional draws so that ratings stay
+        finite when an entrant won all its games. Confidence intervals come from the inverse of the Hessian of the
+        log likelihood, they are relative to the anchor.
+
+        Parameters
+        -----------
+        - **anchor**: the entrant whose rating is fixed, the first one by default
+        - **anchor_rating**: the rating of the anchor
+        - **virtual_draws**: the number of draws added to each pair that played
+        - **confidence**: the number of standard deviations of the confidence intervals, 1.96 for 95%
+
+        Return
+        -----------
+        The rating and the half width of its confidence interval of each entrant.
+        """
+        games, points = self.scores()
+        played = games > 0
+        games = games + virtual_draws * played
+        points = points + virtual_draws / 2 * played
+        n = len(self.names)
+        anchor_index = self.names.index(anchor) if anchor is not None else 0
+        free = np.arange(n) != anchor_index
+        # Ratings in natural units: the expected score of i against j is sigmoid(q_i - q_j)
+        q = np.zeros(n)
+        for _ in range(100):
+            expected = 1 / (1 + np.exp(q[np.newaxis, :] - q[:, np.newaxis]))
+            gradient = np.sum(points - games * expected, axis=1)
+            weights = games * expected * (1 - expected)
+            hessian = weights - np.diag(np.sum(weights, axis=1))
+            step = np.linalg.lstsq(hessian[np.ix_(free, free)], gradient[free], rcond=None)[0]
+            q[free] -= step
+            if np.max(np.abs(step)) < 1e-10:
+                break
+        scale = 400 / np.log(10)
+        errors = np.zeros(n)
+        covariance = np.linalg.pinv(-hessian[np.ix_(free, free)])
+        errors[free] = np.sqrt(np.maximum(np.diag(covariance), 0))
+        return {name: (anchor_rating + scale * q[k], confidence * scale * errors[k]) for k, name in enumerate(self.names)}
+
+    def format_table(self) -> str:
+        """
+        Format the wins, draws and losses of each entrant against each other one.
+        """
+        totals = self.outcomes.sum(axis=2)
+        width = max(12, max(len(name) for name in self.names) + 2)
+        lines = ["".ljust(width) + "".join(name.rjust(width) for name in self.names)]
+        for i, name in enumerate(self.names):
+            cells = ["-".rjust(width) if i == j else "{}/{}/{}".format(*totals[i, j]).rjust(width) for j in range(len(self.names))]
+            lines.append(name.ljust(width) + "".join(cells))
+        return "\n".join(lines)
+
+    def format_elo(self, **kwargs) -> str:
+        """
+        Format the Elo ratings from the best to the worst, the keyword arguments are passed to ```elo```.
+        """
+        games, points = self.scores()
+        ratings = self.elo(**kwargs)
+        width = max(12, max(len(name) for name in self.names) + 2)
+        lines = ["{}{:>10}{:>10}{:>10}{:>10}".format("entrant".ljust(width), "elo", "+/-", "games", "score")]
+        for name in sorted(self.names, key=lambda name: -ratings[name][0]):
+            k = self.names.index(name)
+            total = np.sum(games[k])
+            lines.append("{}{:>10.0f}{:>10.0f}{:>10}{:>9.1f}%".format(
+                name.ljust(width), ratings[name][0], ratings[name][1], total, 100 * np.sum(points[k]) / max(1, total)))
+        return "\n".join(lines)
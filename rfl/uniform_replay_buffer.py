@@ -1,34 +1,73 @@
 from rfl.env.abstract_environment import Episode
 from rfl.abstract_replay_buffer import AbstractReplayBuffer, SARSTuple
 from rfl.datastructure.ref_counted_list import RefCountedList
+from rfl.deferred import Deferred, resolve_deferred
+from rfl.state_codec import StateCodec, encode_episode, decode_windows, episodes_to_arrays, arrays_to_episodes
 
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 
 
 class UniformReplayBuffer(AbstractReplayBuffer):
 
-    def __init__(self, size: int = 10000, seed: int = 0):
+    def __init__(self, size: int = 10000, seed: int = 0, codec: Optional[StateCodec] = None):
         self._size: int = size
         self._memory: List = []
         self.generator: np.random.Generator = np.random.default_rng(seed)
         self._episodes: RefCountedList = RefCountedList()
+        # If a codec is given, episodes are stored encoded and a memory is only (episode_uid, memory_index_in_ep)
+        self.codec: Optional[StateCodec] = codec
+
+    def __len__(self) -> int:
+        return len(self._memory)
 
     def store(self, episodes: List[Episode]):
         for episode in episodes:
-            uid = self._episodes.append(episode, len(episode))
             T = len(episode) - 1
-            for j, (state, action, reward) in enumerate(reversed(episode)):
-                self._memory.append((uid, T - j, state, action, reward))
-            self._episodes.append(episode)
+            if self.codec:
+                uid = self._episodes.append(encode_episode(self.codec, episode), len(episode))
+                for j in range(len(episode)):
+                    self._memory.append((uid, T - j))
+            else:
+                uid = self._episodes.append(episode, len(episode))
+                for j, (state, action, reward) in enumerate(reversed(episode)):
+                    self._memory.append((uid, T - j, state, action, reward))
         if len(self._memory) > self._size:
-            for (uid, _, _, _, _) in self._memory[:-self._size]:
-                self._episodes.decrease_refs(uid, 1)
+            for memory in self._memory[:-self._size]:
+                self._episodes.decrease_refs(memory[0], 1)
             self._memory = self._memory[-self._size:]
 
+    def state_dict(self) -> dict:
+        return resolve_deferred(self.deferred_state_dict())
+
+    def deferred_state_dict(self) -> dict:
+        packed = self.codec is not None
+        # Memories are tuples and episodes are not modified once stored, copying the containers is a consistent snapshot
+        memory = list(self._memory)
+        episodes = self._episodes.snapshot()
+        return {"size": self._size, "generator": self.generator.bit_generator.state,
+                "uids": Deferred(lambda: np.asarray([m[0] for m in memory], dtype=np.int64)),
+                "indices": Deferred(lambda: np.asarray([m[1] for m in memory], dtype=np.int64)),
+                "episodes": Deferred(lambda: episodes.state_dict(lambda elements: episodes_to_arrays(elements, packed)))}
+
+    def load_state_dict(self, state: dict):
+        packed = self.codec is not None
+        self._size = state["size"]
+        self.generator.bit_generator.state = state["generator"]
+        self._episodes.load_state_dict(state["episodes"], lambda arrays: arrays_to_episodes(arrays, packed))
+        memories = zip(state["uids"].tolist(), state["indices"].tolist())
+        if packed:
+            self._memory = list(memories)
+        else:
+            self._memory = [(uid, i) + tuple(self._episodes[uid][i]) for uid, i in memories]
+
     def sample(self, size: int, nsteps: int) -> List[SARSTuple]:
-        memories = self.generator.integers(0, len(self._memory), size, dtype=np.int)
+        memories = self.generator.integers(0, len(self._memory), size)
+        if self.codec:
+            windows = [(self._episodes[episode_uid], memory_index) for (episode_uid, memory_index) in
+                       (self._memory[g_index] for g_index in memories)]
+            return decode_windows(self.codec, windows, nsteps)
         output = []
         for g_index in memories:
             (episode_uid, memory_index, state, action, reward) = self._memory[g_index]